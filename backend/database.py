@@ -1,22 +1,57 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime, Float, text as sa_text
+from sqlalchemy import create_engine, event, Column, Integer, String, Text, DateTime, Float, Index, text as sa_text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.pool import QueuePool
 import datetime
 
 SQLALCHEMY_DATABASE_URL = "sqlite:///./data/trafikinfo.db"
 
 engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SQLALCHEMY_DATABASE_URL,
+    connect_args={"check_same_thread": False},
+    # API requests, SSE streams and the ingestion workers share this pool
+    poolclass=QueuePool,
+    pool_size=10,
+    max_overflow=20,
+    pool_timeout=30,
+    pool_pre_ping=False
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async engine for the ingestion loop and hot read endpoints, so DB I/O does not block the event loop
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./data/trafikinfo.db"
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_size=10,
+    max_overflow=20
+)
+AsyncSessionLocal = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+
+@event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    # WAL lets the API read while the ingestion workers write
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-65536") # 64 MB
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456") # 256 MB
+    cursor.execute("PRAGMA busy_timeout=5000")
+    cursor.close()
+
 Base = declarative_base()
 
 class TrafficEvent(Base):
     __tablename__ = "traffic_events"
+    __table_args__ = (
+        # Covers the Realtid/Planerat time-window filters
+        Index("ix_te_times", "start_time", "end_time"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    external_id = Column(String, index=True) # Trafikverket ID
+    external_id = Column(String, unique=True, index=True) # Trafikverket ID
     event_type = Column(String) # e.g., 'Situation'
     title = Column(String)
     description = Column(Text)
@@ -54,6 +89,10 @@ class TrafficEvent(Base):
     water_equivalent = Column(Float)
 
     pushed_to_mqtt = Column(Integer, default=0) # boolean 0/1
+    long_duration = Column(Integer, default=0) # boolean 0/1, end_time - start_time >= 5 days (set on write)
+
+# Newest-first listing and keyset pagination for /api/events
+Index("ix_te_created_at_id", TrafficEvent.created_at.desc(), TrafficEvent.id.desc())
 
 class TrafficEventVersion(Base):
     __tablename__ = "traffic_event_versions"
@@ -112,6 +151,10 @@ class Camera(Base):
 
 class RoadCondition(Base):
     __tablename__ = "road_conditions"
+    __table_args__ = (
+        # Covers the active (end_time) + "new since" (timestamp) badge filter
+        Index("ix_rc_end_ts", "end_time", "timestamp"),
+    )
 
     id = Column(String, primary_key=True, index=True) # Trafikverket ID
     condition_code = Column(Integer)
@@ -339,7 +382,8 @@ def migrate_db():
                 "grip": "FLOAT",
                 "ice_depth": "FLOAT",
                 "snow_depth": "FLOAT",
-                "water_equivalent": "FLOAT"
+                "water_equivalent": "FLOAT",
+                "long_duration": "INTEGER"
             }
             
             with engine.begin() as conn:
@@ -353,6 +397,14 @@ def migrate_db():
                             if col_name == "updated_at":
                                 print("Backfilling updated_at with created_at...")
                                 conn.execute(sa_text("UPDATE traffic_events SET updated_at = created_at WHERE updated_at IS NULL"))
+
+                            # Backfill long_duration from the stored time window
+                            if col_name == "long_duration":
+                                print("Backfilling long_duration from start_time/end_time...")
+                                conn.execute(sa_text(
+                                    "UPDATE traffic_events SET long_duration = "
+                                    "CASE WHEN julianday(end_time) - julianday(start_time) >= 5 THEN 1 ELSE 0 END"
+                                ))
                         except Exception as e:
                             print(f"Error adding column {col_name}: {e}")
 
@@ -361,7 +413,7 @@ def migrate_db():
                     v_columns = [c['name'] for c in inspector.get_columns("traffic_event_versions")]
                     with engine.begin() as conn_v:
                         for col_name, col_type in expected_columns.items():
-                            if col_name not in v_columns and col_name not in ["pushed_to_mqtt", "updated_at"]:
+                            if col_name not in v_columns and col_name not in ["pushed_to_mqtt", "updated_at", "long_duration"]:
                                 print(f"Migrating versions: Adding missing column '{col_name}'")
                                 try:
                                     conn_v.execute(sa_text(f"ALTER TABLE traffic_event_versions ADD COLUMN {col_name} {col_type}"))
@@ -434,5 +486,48 @@ def migrate_db():
                             conn_cam.execute(sa_text(f"ALTER TABLE cameras ADD COLUMN {col_name} {col_type}"))
                         except Exception as e:
                             print(f"Error adding column {col_name} to cameras: {e}")
+
+        # external_id used to have a plain index; make it unique (keeping the newest row of any duplicates)
+        if "traffic_events" in inspector.get_table_names():
+            te_indexes = {idx["name"]: idx for idx in inspector.get_indexes("traffic_events")}
+            ext_idx = te_indexes.get("ix_traffic_events_external_id")
+            if ext_idx and not ext_idx.get("unique"):
+                print("Migrating traffic_events: Making external_id index unique")
+                duplicates = (
+                    "SELECT id FROM traffic_events WHERE external_id IS NOT NULL AND id NOT IN "
+                    "(SELECT MAX(id) FROM traffic_events WHERE external_id IS NOT NULL GROUP BY external_id)"
+                )
+                try:
+                    with engine.begin() as conn:
+                        dup_ids = [row[0] for row in conn.execute(sa_text(duplicates))]
+                        if dup_ids:
+                            # History of a removed duplicate moves to the row that is kept
+                            moved = conn.execute(sa_text(
+                                "UPDATE traffic_event_versions SET event_id = ("
+                                "SELECT MAX(keep.id) FROM traffic_events dup JOIN traffic_events keep ON keep.external_id = dup.external_id "
+                                "WHERE dup.id = traffic_event_versions.event_id) "
+                                f"WHERE event_id IN ({duplicates})"
+                            )).rowcount
+                            # Keep a copy of the removed rows
+                            conn.execute(sa_text("CREATE TABLE IF NOT EXISTS traffic_events_dedup_backup AS SELECT * FROM traffic_events WHERE 0"))
+                            conn.execute(sa_text(f"INSERT INTO traffic_events_dedup_backup SELECT * FROM traffic_events WHERE id IN ({duplicates})"))
+                            removed = conn.execute(sa_text(f"DELETE FROM traffic_events WHERE id IN ({duplicates})")).rowcount
+                            print(f"Removed {removed} duplicate traffic events, moved {moved} history versions "
+                                  "to the kept rows; removed rows are saved in traffic_events_dedup_backup")
+                        conn.execute(sa_text("DROP INDEX ix_traffic_events_external_id"))
+                        conn.execute(sa_text("CREATE UNIQUE INDEX ix_traffic_events_external_id ON traffic_events (external_id)"))
+                except Exception as e:
+                    print(f"Error making external_id unique: {e}")
+
+        # Indexes declared on the models are only created by create_all() for new tables,
+        # so make sure older databases get them too
+        existing_tables = inspector.get_table_names()
+        for table in Base.metadata.sorted_tables:
+            if table.name in existing_tables:
+                for index in table.indexes:
+                    try:
+                        index.create(bind=engine, checkfirst=True)
+                    except Exception as e:
+                        print(f"Error creating index {index.name}: {e}")
     except Exception as e:
         print(f"Migration error: {e}")
@@ -1,20 +1,29 @@
 VERSION = "26.2.94"
-from fastapi import FastAPI, Depends, BackgroundTasks, HTTPException, Header, status, Response, Cookie, Body
+from fastapi import FastAPI, Depends, BackgroundTasks, HTTPException, Header, status, Response, Cookie, Body, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, StreamingResponse
-from sqlalchemy.orm import Session
+from fastapi.responses import FileResponse, StreamingResponse, JSONResponse
+from sse_starlette.sse import EventSourceResponse, ServerSentEvent
+from sqlalchemy.orm import Session, load_only
 import asyncio
 import os
 import json
+import orjson
 import logging
 import httpx
 import re
 import math
 import time
+import threading
+import itertools
+from contextlib import asynccontextmanager
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Optional
 from datetime import datetime, time as dt_time, timedelta
-from sqlalchemy import func
+from sqlalchemy import func, update, select, or_, and_, bindparam, DateTime
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from pywebpush import webpush, WebPushException
 from py_vapid import Vapid
@@ -22,9 +31,9 @@ import base64
 import hashlib
 from cryptography.fernet import Fernet
 
-from database import SessionLocal, init_db, TrafficEvent, TrafficEventVersion, Settings, Camera, RoadCondition, RoadConditionVersion, PushSubscription, ClientInterest
+from database import SessionLocal, AsyncSessionLocal, async_engine, init_db, TrafficEvent, TrafficEventVersion, Settings, Camera, RoadCondition, RoadConditionVersion, PushSubscription, ClientInterest
 from mqtt_client import mqtt_client
-from trafikverket import TrafikverketStream, parse_situation, get_cameras, find_nearby_cameras, parse_road_condition
+from trafikverket import TrafikverketStream, parse_situations_batch, get_cameras, find_nearby_cameras, parse_road_condition, parse_wgs84
 
 # Setup logging
 debug_mode = os.getenv("DEBUG_MODE", "false").lower() == "true"
@@ -67,6 +76,9 @@ DEFAULTS = {
     "sound_notifications_enabled": "false"
 }
 
+# Public Trafikverket icon URL (fallback for clients that can't reach our /api/icons proxy)
+ICON_URL_TEMPLATE = "https://api.trafikinfo.trafikverket.se/v1/icons/{}?type=png32x32"
+
 MDI_ICON_MAP = {
     "roadwork": "mdi:cone",
     "trafficMessage": "mdi:alert",
@@ -162,7 +174,17 @@ print(r"""
 """)
 print(f"🚀 Trafikinfo Flux v{VERSION} Starting...")
 
-app = FastAPI(title="Trafikinfo API", version=VERSION)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await startup_event()
+    yield
+    await shutdown_event()
+
+app = FastAPI(title="Trafikinfo API", version=VERSION, lifespan=lifespan)
+
+def orjson_response(content, headers: dict = None):
+    """Encodes plain dicts/lists (datetimes included) with orjson, skipping jsonable_encoder."""
+    return Response(content=orjson.dumps(content), media_type="application/json", headers=headers)
 
 def get_db():
     db = SessionLocal()
@@ -171,12 +193,21 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+async def commit_off_loop(db: Session):
+    """Commits a sync session in a worker thread. Waiting for SQLite's write lock on the loop
+    thread would stall the async ingest session that holds it until busy_timeout."""
+    await asyncio.to_thread(db.commit)
+
 class LoginRequest(BaseModel):
     password: str
 
 
 @app.post("/api/client/interest")
-async def update_client_interest(
+def update_client_interest(
     payload: dict = Body(...),
     x_client_id: Optional[str] = Header(None),
     user_agent: Optional[str] = Header(None, alias="User-Agent"),
@@ -305,7 +336,7 @@ async def login(request: LoginRequest):
         )
 
 @app.post("/api/auth/app-login")
-async def app_login(
+def app_login(
     request: LoginRequest, 
     response: Response,
     x_client_id: Optional[str] = Header(None),
@@ -370,6 +401,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Before", "X-Next-Before-Id"],
 )
 
 # Background task tracking
@@ -388,15 +420,28 @@ cleanup_task = None
 weather_sync_task = None
 cameras = []
 weather_stations = {}
+# Situation / road condition payloads are parsed off the event loop
+parse_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="parse")
+# Snapshot and icon downloads share one pooled client instead of a new connection per image
+MEDIA_HTTP_LIMITS = httpx.Limits(max_connections=20, max_keepalive_connections=4)
+media_client = None
+
+def get_media_client():
+    global media_client
+    if media_client is None:
+        media_client = httpx.AsyncClient(timeout=15.0, limits=MEDIA_HTTP_LIMITS)
+    return media_client
+
+# Live event fanout and the settings/badge caches are per process, so only one worker is supported
+if int(os.getenv("WORKERS", "1")) > 1:
+    logger.error("WORKERS > 1 is not supported (live events and caches are per process), running a single worker")
 
-
-@app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutdown requested, stopping background tasks...")
     global stream_task, processor_task, refresh_task, init_cameras_task, tv_stream
-    global rc_stream_task, rc_processor_task, rc_stream, cleanup_task
+    global rc_stream_task, rc_processor_task, rc_stream, cleanup_task, mqtt_pump_task
     
-    tasks = [t for t in [stream_task, processor_task, refresh_task, init_cameras_task, rc_stream_task, rc_processor_task, cleanup_task] if t]
+    tasks = [t for t in [stream_task, processor_task, refresh_task, init_cameras_task, rc_stream_task, rc_processor_task, cleanup_task, mqtt_pump_task] if t]
     if tasks:
         for task in tasks:
             task.cancel()
@@ -404,8 +449,16 @@ async def shutdown_event():
     
     if tv_stream:
         tv_stream.stop_streaming()
+        await tv_stream.aclose()
     if rc_stream:
         rc_stream.stop_streaming()
+        await rc_stream.aclose()
+    if stream_close_tasks:
+        await asyncio.gather(*stream_close_tasks, return_exceptions=True)
+    if media_client:
+        await media_client.aclose()
+    parse_executor.shutdown(wait=False, cancel_futures=True)
+    await async_engine.dispose()
     logger.info("Shutdown complete")
 
 async def sync_icons():
@@ -442,12 +495,11 @@ async def sync_icons():
                 icon_url += "?type=png32x32"
                 
             try:
-                async with httpx.AsyncClient(timeout=15.0) as client:
-                    r = await client.get(icon_url)
-                    if r.status_code == 200:
-                        with open(local_path, "wb") as f:
-                            f.write(r.content)
-                        count += 1
+                r = await get_media_client().get(icon_url)
+                if r.status_code == 200:
+                    with open(local_path, "wb") as f:
+                        f.write(r.content)
+                    count += 1
             except Exception as e:
                 logger.error(f"Failed to download icon {icon_id}: {e}")
                 
@@ -457,6 +509,17 @@ async def sync_icons():
     except Exception as e:
         logger.error(f"Error during icon sync: {e}")
 
+def delete_old_records(db: Session, cutoff_date: datetime):
+    """Deletes events and road conditions (with their versions) last updated before cutoff_date."""
+    db.query(TrafficEventVersion).filter(TrafficEventVersion.version_timestamp < cutoff_date).delete()
+    events_deleted = db.query(TrafficEvent).filter(TrafficEvent.updated_at < cutoff_date).delete()
+
+    db.query(RoadConditionVersion).filter(RoadConditionVersion.timestamp < cutoff_date).delete()
+    rcs_deleted = db.query(RoadCondition).filter(RoadCondition.updated_at < cutoff_date).delete()
+
+    db.commit()
+    return events_deleted, rcs_deleted
+
 async def periodic_cleanup():
     """Background task to clean up old events and snapshots based on retention_days."""
     while True:
@@ -470,13 +533,7 @@ async def periodic_cleanup():
                 logger.info(f"Running periodic cleanup. Removing events and snapshots older than {cutoff_date} ({days} days)")
                 
                 # Delete old DB records
-                db.query(TrafficEventVersion).filter(TrafficEventVersion.version_timestamp < cutoff_date).delete()
-                events_deleted = db.query(TrafficEvent).filter(TrafficEvent.updated_at < cutoff_date).delete()
-                
-                db.query(RoadConditionVersion).filter(RoadConditionVersion.timestamp < cutoff_date).delete()
-                rcs_deleted = db.query(RoadCondition).filter(RoadCondition.updated_at < cutoff_date).delete()
-                
-                db.commit()
+                events_deleted, rcs_deleted = await asyncio.to_thread(delete_old_records, db, cutoff_date)
                 
                 # Delete files in SNAPSHOTS_DIR older than cutoff_date
                 cutoff_timestamp = datetime.now().timestamp() - (days * 86400)
@@ -510,6 +567,14 @@ async def periodic_icon_sync():
             logger.error(f"Error in periodic_icon_sync: {e}")
         await asyncio.sleep(604800) # Once every 7 days
 
+# Closes of replaced streams still in flight; referenced here so they are not garbage collected
+stream_close_tasks = set()
+
+def close_stream_later(stream):
+    task = asyncio.create_task(stream.aclose())
+    stream_close_tasks.add(task)
+    task.add_done_callback(stream_close_tasks.discard)
+
 def start_worker(api_key: str, county_ids: list = None):
     global stream_task, processor_task, refresh_task, init_cameras_task, tv_stream, cameras
     global rc_stream, rc_stream_task, rc_processor_task, weather_sync_task
@@ -519,10 +584,10 @@ def start_worker(api_key: str, county_ids: list = None):
     for t in tasks_to_cancel:
         t.cancel()
     
-    if tv_stream:
-        tv_stream.stop_streaming()
-    if rc_stream:
-        rc_stream.stop_streaming()
+    for old_stream in (tv_stream, rc_stream):
+        if old_stream:
+            old_stream.stop_streaming()
+            close_stream_later(old_stream)
     
     # If no counties are selected (Family Model), do not start streams.
     if not county_ids:
@@ -541,7 +606,7 @@ def start_worker(api_key: str, county_ids: list = None):
     # Initialize cameras and start background refresh
     async def init_cameras():
         global cameras, refresh_task
-        cameras = await get_cameras(api_key)
+        cameras = await get_cameras(api_key, tv_stream.http_client)
         logger.info(f"Loaded {len(cameras)} traffic cameras")
         refresh_task = asyncio.create_task(refresh_cameras(api_key))
 
@@ -714,7 +779,7 @@ async def initialize_cameras():
                                         )
                                         db.add(new_cam)
                              
-                             db.commit()
+                             await commit_off_loop(db)
                              # Re-query
                              current_cameras = db.query(Camera).all()
                              logger.info(f"Initialized {len(current_cameras)} cameras from API.")
@@ -788,11 +853,8 @@ async def initialize_weather_stations():
                             wgs84 = s.get('Geometry', {}).get('WGS84')
                             if not sid or not wgs84: continue
                             
-                            match = re.search(r"\(([\d\.]+)\s+([\d\.]+)", wgs84)
-                            if not match: continue
-                            
-                            lon = float(match.group(1))
-                            lat = float(match.group(2))
+                            lon, lat = parse_wgs84(wgs84)
+                            if lon is None: continue
                             
                             existing = db.query(WeatherMeasurepoint).filter(WeatherMeasurepoint.id == sid).first()
                             if not existing:
@@ -812,7 +874,7 @@ async def initialize_weather_stations():
                             else:
                                 existing.county_no = 0
 
-                        db.commit()
+                        await commit_off_loop(db)
                         # Re-query
                         current_ws = db.query(WeatherMeasurepoint).all()
                         logger.info(f"Initialized {len(current_ws)} weather stations.")
@@ -1010,469 +1072,605 @@ async def download_camera_snapshot(url: str, event_id: str, county_no: int, expl
     filepath = os.path.join(SNAPSHOTS_DIR, relative_path)
     
     try:
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            # Try fullsize first
-            logger.debug(f"Attempting to download fullsize image from {fullsize_url}")
-            response = await client.get(fullsize_url)
+        client = get_media_client()
+        # Try fullsize first
+        logger.debug(f"Attempting to download fullsize image from {fullsize_url}")
+        response = await client.get(fullsize_url)
             
-            # Check if fullsize is valid (200 OK AND sufficiently large)
-            is_valid_fullsize = False
-            if response.status_code == 200:
-                # 5KB is a very safe floor for "real" image
-                if len(response.content) >= 5000:
-                    is_valid_fullsize = True
+        # Check if fullsize is valid (200 OK AND sufficiently large)
+        is_valid_fullsize = False
+        if response.status_code == 200:
+            # 5KB is a very safe floor for "real" image
+            if len(response.content) >= 5000:
+                is_valid_fullsize = True
                 
-                # Warn if suspiciously small for a fullsize image, but don't reject it if >5KB
-                if len(response.content) < 15000:
-                    logger.info(f"Snapshot from {fullsize_url} is small ({len(response.content)} bytes), but accepted as fullsize.")
-            else:
-                logger.error(f"Failed to download from {fullsize_url}: Status {response.status_code}")
+            # Warn if suspiciously small for a fullsize image, but don't reject it if >5KB
+            if len(response.content) < 15000:
+                logger.info(f"Snapshot from {fullsize_url} is small ({len(response.content)} bytes), but accepted as fullsize.")
+        else:
+            logger.error(f"Failed to download from {fullsize_url}: Status {response.status_code}")
             
-            # Fallback to original URL if fullsize failed or was too small
-            if not is_valid_fullsize and fullsize_url != url:
-                logger.info(f"Fullsize image too small ({len(response.content)} bytes) or failed, falling back to base URL: {url}")
-                response = await client.get(url)
+        # Fallback to original URL if fullsize failed or was too small
+        if not is_valid_fullsize and fullsize_url != url:
+            logger.info(f"Fullsize image too small ({len(response.content)} bytes) or failed, falling back to base URL: {url}")
+            response = await client.get(url)
             
-            if response.status_code == 200:
-                content_size = len(response.content)
-                if content_size < 1500:
-                    logger.error(f"Downloaded image for {event_id} is way too small ({content_size} bytes). Likely an error message or corrupt file. Skipping.")
-                    return None
+        if response.status_code == 200:
+            content_size = len(response.content)
+            if content_size < 1500:
+                logger.error(f"Downloaded image for {event_id} is way too small ({content_size} bytes). Likely an error message or corrupt file. Skipping.")
+                return None
                 
-                if content_size < 5000:
-                    logger.warning(f"Downloaded snapshot for {event_id} is fairly small ({content_size} bytes). Might be a thumbnail.")
+            if content_size < 5000:
+                logger.warning(f"Downloaded snapshot for {event_id} is fairly small ({content_size} bytes). Might be a thumbnail.")
                 
-                with open(filepath, "wb") as f:
-                    f.write(response.content)
+            with open(filepath, "wb") as f:
+                f.write(response.content)
                 
-                logger.debug(f"Saved snapshot to {filepath} ({content_size} bytes)")
-                return relative_path
-            else:
-                logger.warning(f"Failed to download snapshot from {url}: {response.status_code}")
+            logger.debug(f"Saved snapshot to {filepath} ({content_size} bytes)")
+            return relative_path
+        else:
+            logger.warning(f"Failed to download snapshot from {url}: {response.status_code}")
     except Exception as e:
         logger.error(f"Error downloading snapshot for event {event_id}: {e}")
     
     return None
 
+# Events lasting at least this long are listed as "Planerat" rather than "Realtid"
+LONG_DURATION = timedelta(days=5)
+
+def is_long_duration(start_time, end_time):
+    """Returns 1 if the event window spans LONG_DURATION or more, else 0 (stored on TrafficEvent.long_duration)."""
+    if not start_time or not end_time:
+        return 0
+    return 1 if end_time - start_time >= LONG_DURATION else 0
+
+# Outgoing MQTT event payloads: (event id, mqtt_data), drained by mqtt_pump
+mqtt_out = asyncio.Queue(maxsize=1024)
+mqtt_pump_task = None
+
+def reset_mqtt_flags(event_ids):
+    """Marks events that could not be published to MQTT."""
+    db = SessionLocal()
+    try:
+        db.execute(
+            update(TrafficEvent)
+            .where(TrafficEvent.id.in_(event_ids))
+            .values(pushed_to_mqtt=0, updated_at=TrafficEvent.updated_at)
+        )
+        db.commit()
+    finally:
+        db.close()
+
+async def publish_mqtt_batch(batch):
+    """Publishes a coalesced batch and reconciles pushed_to_mqtt for failures."""
+    # paho runs on this event loop, so publish here and only move the DB write to a thread
+    results = mqtt_client.publish_events([mqtt_data for _, mqtt_data in batch])
+    failed_ids = [event_id for (event_id, _), ok in zip(batch, results) if not ok]
+    if failed_ids:
+        await asyncio.to_thread(reset_mqtt_flags, failed_ids)
+
+async def mqtt_pump():
+    """Publishes queued MQTT events off the ingest path. Everything waiting in the queue is
+    sent as one batch, with only the latest payload per external_id."""
+    while True:
+        try:
+            item = await mqtt_out.get()
+            batch = {item[1]['external_id']: item}
+            while not mqtt_out.empty():
+                item = mqtt_out.get_nowait()
+                batch[item[1]['external_id']] = item
+            await publish_mqtt_batch(list(batch.values()))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"MQTT pump error: {e}")
+
+# Columns written by the event upsert; id, created_at, updated_at and pushed_to_mqtt use their defaults
+UPSERT_EVENT_COLUMNS = [
+    c.key for c in TrafficEvent.__table__.columns
+    if c.key not in ("id", "created_at", "updated_at", "pushed_to_mqtt")
+]
+
 async def event_processor():
     global tv_stream, cameras
     try:
-        async for raw_data in tv_stream.get_events():
-            events = parse_situation(raw_data)
-            
-            # Create a new session for this batch
-            db = SessionLocal()
-            try:
-                # Get camera radius setting
-                radius_setting = db.query(Settings).filter(Settings.key == "camera_radius_km").first()
-                max_dist = float(radius_setting.value) if radius_setting else 5.0
-                for ev in events:
-                    # Check if event already exists to decide if we need to fetch cameras
-                    existing = db.query(TrafficEvent).filter(TrafficEvent.external_id == ev['external_id']).first()
+        async for raw_batch in tv_stream.get_event_batches():
+            # Everything buffered is parsed with one round trip to the parse workers
+            parsed_batch = await asyncio.get_running_loop().run_in_executor(parse_executor, parse_situations_batch, raw_batch)
+            for events in parsed_batch:
+                # Create a new session for each payload
+                db = AsyncSessionLocal()
+                try:
+                    # Get camera radius setting
+                    radius_setting = await db.scalar(select(Settings).where(Settings.key == "camera_radius_km"))
+                    max_dist = float(radius_setting.value) if radius_setting else 5.0
+
+                    # The same situation can appear more than once in a payload, keep the last version
+                    events = list({ev.external_id: ev for ev in events}.values())
+
+                    # Parsed events with their ORM row: (ev, event, is_update, push_relevant_change)
+                    processed = []
+                    to_insert = []
+                    # Load all already known events of this payload with one IN query
+                    existing_map = {
+                        row.external_id: row
+                        for row in await db.scalars(select(TrafficEvent).where(TrafficEvent.external_id.in_([ev.external_id for ev in events])))
+                    }
+
+                    for ev in events:
+                        # Check if event already exists to decide if we need to fetch cameras
+                        existing = existing_map.get(ev.external_id)
+
+                        # Parsed once per event; stored naive like everything else in the DB
+                        start_dt = datetime.fromisoformat(ev.start_time).replace(tzinfo=None) if ev.start_time else None
+                        end_dt = datetime.fromisoformat(ev.end_time).replace(tzinfo=None) if ev.end_time else None
                     
-                    primary_cam = None
-                    camera_url = None
-                    camera_name = None
-                    fullsize_url = None
-                    extra_cameras_json = None
+                        primary_cam = None
+                        camera_url = None
+                        camera_name = None
+                        fullsize_url = None
+                        extra_cameras_json = None
                     
-                    # Logic to determine if we should fetch/download cameras
-                    # 1. New event
-                    # 2. Existing event but no extra_cameras yet
-                    # 3. Location changed significantly?
-                    needs_camera_sync = False
-                    if not existing:
-                        needs_camera_sync = True
-                    else:
-                        loc_changed = False
-                        if ev.get('latitude') is not None and existing.latitude != ev.get('latitude'):
-                            loc_changed = True
-                        if ev.get('longitude') is not None and existing.longitude != ev.get('longitude'):
-                            loc_changed = True
+                        # Logic to determine if we should fetch/download cameras
+                        # 1. New event
+                        # 2. Existing event but no extra_cameras yet
+                        # 3. Location changed significantly?
+                        needs_camera_sync = False
+                        if not existing:
+                            needs_camera_sync = True
+                        else:
+                            loc_changed = False
+                            if ev.latitude is not None and existing.latitude != ev.latitude:
+                                loc_changed = True
+                            if ev.longitude is not None and existing.longitude != ev.longitude:
+                                loc_changed = True
                         
-                        # Check if we have missing snapshots in extra cameras
-                        has_missing_extra = False
-                        if existing.extra_cameras:
-                            try:
-                                extra_c_list = json.loads(existing.extra_cameras)
-                                if any(not c.get('snapshot') for c in extra_c_list):
+                            # Check if we have missing snapshots in extra cameras
+                            has_missing_extra = False
+                            if existing.extra_cameras:
+                                try:
+                                    extra_c_list = orjson.loads(existing.extra_cameras)
+                                    if any(not c.get('snapshot') for c in extra_c_list):
+                                        has_missing_extra = True
+                                except:
                                     has_missing_extra = True
-                            except:
-                                has_missing_extra = True
 
-                        if loc_changed or has_missing_extra:
-                            needs_camera_sync = True
+                            if loc_changed or has_missing_extra:
+                                needs_camera_sync = True
 
-                    if needs_camera_sync:
-                        # Find nearby cameras
-                        nearby_cams = find_nearby_cameras(ev.get('latitude'), ev.get('longitude'), cameras, target_road=ev.get('road_number'), max_dist_km=max_dist)
+                        if needs_camera_sync:
+                            # Find nearby cameras
+                            nearby_cams = find_nearby_cameras(ev.latitude, ev.longitude, cameras, target_road=ev.road_number, max_dist_km=max_dist)
                         
-                        primary_cam = nearby_cams[0] if nearby_cams else None
-                        camera_url = primary_cam.get('url') if primary_cam else None
-                        camera_name = primary_cam.get('name') if primary_cam else None
-                        fullsize_url = primary_cam.get('fullsize_url') if primary_cam else None
+                            primary_cam = nearby_cams[0] if nearby_cams else None
+                            camera_url = primary_cam.get('url') if primary_cam else None
+                            camera_name = primary_cam.get('name') if primary_cam else None
+                            fullsize_url = primary_cam.get('fullsize_url') if primary_cam else None
                         
-                        # Process extra cameras
-                        extra_cams_data = []
-                        if len(nearby_cams) > 1:
-                            for idx, c in enumerate(nearby_cams[1:]):
-                                cam_url = c.get('url')
-                                if not cam_url:
-                                    continue
+                            # Process extra cameras
+                            extra_cams_data = []
+                            if len(nearby_cams) > 1:
+                                for idx, c in enumerate(nearby_cams[1:]):
+                                    cam_url = c.get('url')
+                                    if not cam_url:
+                                        continue
                                     
-                                # Ensure we have a safe ID for the filename
-                                cam_id_safe = str(c.get('id', idx)).replace(":", "_")
-                                c_snap = await download_camera_snapshot(cam_url, f"{ev['external_id']}_{cam_id_safe}", ev.get('county_no', 0), c.get('fullsize_url'))
-                                extra_cams_data.append({
-                                    "id": c.get('id'),
-                                    "name": c.get('name'),
-                                    "snapshot": c_snap
-                                })
-
-                        extra_cameras_json = json.dumps(extra_cams_data) if extra_cams_data else None
-                    else:
-                        # Use existing camera data
-                        camera_url = existing.camera_url
-                        camera_name = existing.camera_name
-                        extra_cameras_json = existing.extra_cameras
-                        # We still need fullsize_url if we want to update the primary snapshot later
-                        # but if we have existing.camera_snapshot, it won't be called.
+                                    # Ensure we have a safe ID for the filename
+                                    cam_id_safe = str(c.get('id', idx)).replace(":", "_")
+                                    c_snap = await download_camera_snapshot(cam_url, f"{ev.external_id}_{cam_id_safe}", ev.county_no, c.get('fullsize_url'))
+                                    extra_cams_data.append({
+                                        "id": c.get('id'),
+                                        "name": c.get('name'),
+                                        "snapshot": c_snap
+                                    })
+
+                            extra_cameras_json = orjson.dumps(extra_cams_data).decode() if extra_cams_data else None
+                        else:
+                            # Use existing camera data
+                            camera_url = existing.camera_url
+                            camera_name = existing.camera_name
+                            extra_cameras_json = existing.extra_cameras
+                            # We still need fullsize_url if we want to update the primary snapshot later
+                            # but if we have existing.camera_snapshot, it won't be called.
                     
-                    push_relevant_change = False
-                    if existing:
-                        push_relevant_change = (
-                            existing.title != ev['title'] or
-                            existing.location != ev['location'] or
-                            existing.severity_code != ev.get('severity_code') or
-                            existing.message_type != ev.get('message_type') or
-                            existing.icon_id != ev.get('icon_id') or
-                            existing.county_no != ev.get('county_no', 0)
-                        )
+                        push_relevant_change = False
+                        if existing:
+                            push_relevant_change = (
+                                existing.title != ev.title or
+                                existing.location != ev.location or
+                                existing.severity_code != ev.severity_code or
+                                existing.message_type != ev.message_type or
+                                existing.icon_id != ev.icon_id or
+                                existing.county_no != ev.county_no
+                            )
                         
-                        if not push_relevant_change and ev.get('end_time'):
-                            new_end_time = datetime.fromisoformat(ev['end_time']).replace(tzinfo=None)
-                            if not existing.end_time:
-                                push_relevant_change = True
-                            else:
-                                diff = abs((new_end_time - existing.end_time).total_seconds()) / 60
-                                if diff >= 15:
+                            if not push_relevant_change and end_dt:
+                                if not existing.end_time:
                                     push_relevant_change = True
-                        # Check if anything significant changed before updating
-                        # We compare: title, description, location, severity_code, message_type, times
-                        has_changed = (
-                            existing.title != ev['title'] or
-                            existing.description != ev['description'] or
-                            existing.location != ev['location'] or
-                            existing.severity_code != ev.get('severity_code') or
-                            existing.message_type != ev.get('message_type') or
-                            existing.temporary_limit != ev.get('temporary_limit') or
-                            existing.traffic_restriction_type != ev.get('traffic_restriction_type') or
-                            (ev.get('start_time') and existing.start_time != datetime.fromisoformat(ev['start_time'])) or
-                            (ev.get('end_time') and existing.end_time != datetime.fromisoformat(ev['end_time']))
-                        )
-
-                        if has_changed:
-                            # Save history before updating
-                            logger.debug(f"Event {ev['external_id']} changed, saving history version")
-                            history_version = TrafficEventVersion(
-                                event_id=existing.id,
-                                external_id=existing.external_id,
-                                version_timestamp=datetime.now(),
-                                title=existing.title,
-                                description=existing.description,
-                                location=existing.location,
-                                icon_id=existing.icon_id,
-                                message_type=existing.message_type,
-                                severity_code=existing.severity_code,
-                                severity_text=existing.severity_text,
-                                road_number=existing.road_number,
-                                start_time=existing.start_time,
-                                end_time=existing.end_time,
-                                temporary_limit=existing.temporary_limit,
-                                traffic_restriction_type=existing.traffic_restriction_type,
-                                latitude=existing.latitude,
-                                longitude=existing.longitude,
-                                camera_url=existing.camera_url,
-                                camera_name=existing.camera_name,
-                                camera_snapshot=existing.camera_snapshot,
-                                extra_cameras=existing.extra_cameras,
-                                air_temperature=existing.air_temperature,
-                                wind_speed=existing.wind_speed,
-                                wind_direction=existing.wind_direction,
-                                road_temperature=existing.road_temperature,
-                                grip=existing.grip,
-                                ice_depth=existing.ice_depth,
-                                snow_depth=existing.snow_depth,
-                                water_equivalent=existing.water_equivalent
+                                else:
+                                    diff = abs((end_dt - existing.end_time).total_seconds()) / 60
+                                    if diff >= 15:
+                                        push_relevant_change = True
+                            # Check if anything significant changed before updating
+                            # We compare: title, description, location, severity_code, message_type, times
+                            has_changed = (
+                                existing.title != ev.title or
+                                existing.description != ev.description or
+                                existing.location != ev.location or
+                                existing.severity_code != ev.severity_code or
+                                existing.message_type != ev.message_type or
+                                existing.temporary_limit != ev.temporary_limit or
+                                existing.traffic_restriction_type != ev.traffic_restriction_type or
+                                (start_dt and existing.start_time != start_dt) or
+                                (end_dt and existing.end_time != end_dt)
                             )
-                            db.add(history_version)
-
-                        # Update existing event
-                        existing.title = ev['title']
-                        existing.description = ev['description']
-                        existing.location = ev['location']
-                        existing.icon_id = ev['icon_id']
-                        existing.message_type = ev.get('message_type')
-                        existing.severity_code = ev.get('severity_code')
-                        existing.severity_text = ev.get('severity_text')
-                        existing.road_number = ev.get('road_number')
-                        existing.start_time = datetime.fromisoformat(ev['start_time']) if ev.get('start_time') else None
-                        existing.end_time = datetime.fromisoformat(ev['end_time']) if ev.get('end_time') else None
-                        existing.temporary_limit = ev.get('temporary_limit')
-                        existing.traffic_restriction_type = ev.get('traffic_restriction_type')
+
+                            if has_changed:
+                                # Save history before updating
+                                logger.debug(f"Event {ev.external_id} changed, saving history version")
+                                history_version = TrafficEventVersion(
+                                    event_id=existing.id,
+                                    external_id=existing.external_id,
+                                    version_timestamp=datetime.now(),
+                                    title=existing.title,
+                                    description=existing.description,
+                                    location=existing.location,
+                                    icon_id=existing.icon_id,
+                                    message_type=existing.message_type,
+                                    severity_code=existing.severity_code,
+                                    severity_text=existing.severity_text,
+                                    road_number=existing.road_number,
+                                    start_time=existing.start_time,
+                                    end_time=existing.end_time,
+                                    temporary_limit=existing.temporary_limit,
+                                    traffic_restriction_type=existing.traffic_restriction_type,
+                                    latitude=existing.latitude,
+                                    longitude=existing.longitude,
+                                    camera_url=existing.camera_url,
+                                    camera_name=existing.camera_name,
+                                    camera_snapshot=existing.camera_snapshot,
+                                    extra_cameras=existing.extra_cameras,
+                                    air_temperature=existing.air_temperature,
+                                    wind_speed=existing.wind_speed,
+                                    wind_direction=existing.wind_direction,
+                                    road_temperature=existing.road_temperature,
+                                    grip=existing.grip,
+                                    ice_depth=existing.ice_depth,
+                                    snow_depth=existing.snow_depth,
+                                    water_equivalent=existing.water_equivalent
+                                )
+                                db.add(history_version)
+
+                            # Update existing event
+                            existing.title = ev.title
+                            existing.description = ev.description
+                            existing.location = ev.location
+                            existing.icon_id = ev.icon_id
+                            existing.message_type = ev.message_type
+                            existing.severity_code = ev.severity_code
+                            existing.severity_text = ev.severity_text
+                            existing.road_number = ev.road_number
+                            existing.start_time = start_dt
+                            existing.end_time = end_dt
+                            existing.temporary_limit = ev.temporary_limit
+                            existing.traffic_restriction_type = ev.traffic_restriction_type
+                            existing.long_duration = is_long_duration(existing.start_time, existing.end_time)
                         
-                        # Prevent wiping out coordinates if they are missing in specific update
-                        if ev.get('latitude') is not None:
-                            existing.latitude = ev.get('latitude')
-                        if ev.get('longitude') is not None:
-                            existing.longitude = ev.get('longitude')
+                            # Prevent wiping out coordinates if they are missing in specific update
+                            if ev.latitude is not None:
+                                existing.latitude = ev.latitude
+                            if ev.longitude is not None:
+                                existing.longitude = ev.longitude
                         
-                        if has_changed:
-                            existing.updated_at = datetime.now()
+                            if has_changed:
+                                existing.updated_at = datetime.now()
                         
-                        # Fetch and persist weather for existing event
-                        if ev.get('latitude') and ev.get('longitude'):
-                            try:
-                                weather = await get_realtime_weather(ev.get('latitude'), ev.get('longitude'))
-                                if weather:
-                                    existing.air_temperature = weather.get('air_temperature')
-                                    existing.wind_speed = weather.get('wind_speed')
-                                    existing.wind_direction = weather.get('wind_direction')
-                            except Exception as e:
-                                logger.error(f"Weather sync failed for existing event {ev['external_id']}: {e}")
-
-                        # Sync camera metadata for existing events (Only if we found a new ones)
-                        if camera_url:
-                            existing.camera_url = camera_url
-                            existing.camera_name = camera_name
+                            # Fetch and persist weather for existing event
+                            if ev.latitude and ev.longitude:
+                                try:
+                                    weather = await get_realtime_weather(ev.latitude, ev.longitude)
+                                    if weather:
+                                        existing.air_temperature = weather.get('air_temperature')
+                                        existing.wind_speed = weather.get('wind_speed')
+                                        existing.wind_direction = weather.get('wind_direction')
+                                except Exception as e:
+                                    logger.error(f"Weather sync failed for existing event {ev.external_id}: {e}")
+
+                            # Sync camera metadata for existing events (Only if we found a new ones)
+                            if camera_url:
+                                existing.camera_url = camera_url
+                                existing.camera_name = camera_name
                             
-                        # Sync camera metadata for existing events
-                        # Sync camera metadata for existing events
-                        if needs_camera_sync or (has_changed and existing.camera_url):
-                            if primary_cam or existing.camera_url:
-                                # Download fresh snapshot if we have a camera
-                                target_url = camera_url or existing.camera_url
-                                target_fullsize = fullsize_url # might be None, but download_camera_snapshot handles it
+                            # Sync camera metadata for existing events
+                            # Sync camera metadata for existing events
+                            if needs_camera_sync or (has_changed and existing.camera_url):
+                                if primary_cam or existing.camera_url:
+                                    # Download fresh snapshot if we have a camera
+                                    target_url = camera_url or existing.camera_url
+                                    target_fullsize = fullsize_url # might be None, but download_camera_snapshot handles it
                                 
-                                logger.debug(f"Downloading fresh snapshot for updated event {ev['external_id']}")
-                                snapshot_file = await download_camera_snapshot(target_url, ev['external_id'], ev.get('county_no', 0), target_fullsize)
+                                    logger.debug(f"Downloading fresh snapshot for updated event {ev.external_id}")
+                                    snapshot_file = await download_camera_snapshot(target_url, ev.external_id, ev.county_no, target_fullsize)
                                 
-                                if snapshot_file:
-                                    existing.camera_url = target_url
-                                    existing.camera_name = camera_name or existing.camera_name
-                                    existing.camera_snapshot = snapshot_file
-                                    existing.extra_cameras = extra_cameras_json or existing.extra_cameras
+                                    if snapshot_file:
+                                        existing.camera_url = target_url
+                                        existing.camera_name = camera_name or existing.camera_name
+                                        existing.camera_snapshot = snapshot_file
+                                        existing.extra_cameras = extra_cameras_json or existing.extra_cameras
+                                else:
+                                    # No camera found this time and none existed
+                                    pass
                             else:
-                                # No camera found this time and none existed
-                                pass
-                        else:
-                            # No significant change and no sync needed
-                            if camera_url and not existing.camera_snapshot:
-                                existing.camera_snapshot = await download_camera_snapshot(camera_url, ev['external_id'], ev.get('county_no', 0), fullsize_url)
+                                # No significant change and no sync needed
+                                if camera_url and not existing.camera_snapshot:
+                                    existing.camera_snapshot = await download_camera_snapshot(camera_url, ev.external_id, ev.county_no, fullsize_url)
                         
-                        existing.extra_cameras = extra_cameras_json
+                            existing.extra_cameras = extra_cameras_json
 
-                        db.commit()
-                        new_event = existing
-                    else:
-                        new_event = TrafficEvent(
-                            external_id=ev['external_id'],
-                            event_type=ev['event_type'],
-                            title=ev['title'],
-                            description=ev['description'],
-                            location=ev['location'],
-                            icon_id=ev['icon_id'],
-                            message_type=ev.get('message_type'),
-                            severity_code=ev.get('severity_code'),
-                            severity_text=ev.get('severity_text'),
-                            road_number=ev.get('road_number'),
-                            start_time=datetime.fromisoformat(ev['start_time']) if ev.get('start_time') else None,
-                            end_time=datetime.fromisoformat(ev['end_time']) if ev.get('end_time') else None,
-                            temporary_limit=ev.get('temporary_limit'),
-                            traffic_restriction_type=ev.get('traffic_restriction_type'),
-                            latitude=ev.get('latitude'),
-                            longitude=ev.get('longitude'),
-                            county_no=ev.get('county_no', 0),
-                            camera_url=camera_url,
-                            camera_name=camera_name,
-                            extra_cameras=extra_cameras_json
-                        )
+                            new_event = existing
+                        else:
+                            new_event = TrafficEvent(
+                                external_id=ev.external_id,
+                                event_type=ev.event_type,
+                                title=ev.title,
+                                description=ev.description,
+                                location=ev.location,
+                                icon_id=ev.icon_id,
+                                message_type=ev.message_type,
+                                severity_code=ev.severity_code,
+                                severity_text=ev.severity_text,
+                                road_number=ev.road_number,
+                                start_time=start_dt,
+                                end_time=end_dt,
+                                temporary_limit=ev.temporary_limit,
+                                traffic_restriction_type=ev.traffic_restriction_type,
+                                latitude=ev.latitude,
+                                longitude=ev.longitude,
+                                county_no=ev.county_no,
+                                camera_url=camera_url,
+                                camera_name=camera_name,
+                                extra_cameras=extra_cameras_json
+                            )
+                            new_event.long_duration = is_long_duration(new_event.start_time, new_event.end_time)
                         
-                        # Fetch and persist weather for new event
-                        if ev.get('latitude') and ev.get('longitude'):
-                            try:
-                                weather = await get_realtime_weather(ev.get('latitude'), ev.get('longitude'))
-                                if weather:
-                                    new_event.air_temperature = weather.get('air_temperature')
-                                    new_event.wind_speed = weather.get('wind_speed')
-                                    new_event.wind_direction = weather.get('wind_direction')
-                                    new_event.road_temperature = weather.get('road_temperature')
-                                    new_event.grip = weather.get('grip')
-                                    new_event.ice_depth = weather.get('ice_depth')
-                                    new_event.snow_depth = weather.get('snow_depth')
-                                    new_event.water_equivalent = weather.get('water_equivalent')
-                            except Exception as e:
-                                logger.error(f"Weather sync failed for new event {ev['external_id']}: {e}")
+                            # Fetch and persist weather for new event
+                            if ev.latitude and ev.longitude:
+                                try:
+                                    weather = await get_realtime_weather(ev.latitude, ev.longitude)
+                                    if weather:
+                                        new_event.air_temperature = weather.get('air_temperature')
+                                        new_event.wind_speed = weather.get('wind_speed')
+                                        new_event.wind_direction = weather.get('wind_direction')
+                                        new_event.road_temperature = weather.get('road_temperature')
+                                        new_event.grip = weather.get('grip')
+                                        new_event.ice_depth = weather.get('ice_depth')
+                                        new_event.snow_depth = weather.get('snow_depth')
+                                        new_event.water_equivalent = weather.get('water_equivalent')
+                                except Exception as e:
+                                    logger.error(f"Weather sync failed for new event {ev.external_id}: {e}")
+
+                            # Save primary snapshot
+                            if camera_url:
+                                new_event.camera_snapshot = await download_camera_snapshot(camera_url, ev.external_id, ev.county_no, fullsize_url)
+                            to_insert.append(new_event)
+
+                        processed.append((ev, new_event, bool(existing), push_relevant_change))
+
+                    if not processed:
+                        continue
+
+                    # Write updates and history versions of this payload together
+                    await db.flush()
+
+                    # Insert new events as one upsert: an event inserted concurrently since the
+                    # prefetch is updated instead of failing the batch. RETURNING gives the ids.
+                    if to_insert:
+                        rows = [{c: getattr(event, c) for c in UPSERT_EVENT_COLUMNS} for event in to_insert]
+                        stmt = sqlite_insert(TrafficEvent).values(rows)
+                        stmt = stmt.on_conflict_do_update(
+                            index_elements=[TrafficEvent.external_id],
+                            set_={
+                                **{c: stmt.excluded[c] for c in UPSERT_EVENT_COLUMNS if c != "external_id"},
+                                "updated_at": datetime.now()
+                            }
+                        ).returning(TrafficEvent)
+                        upserted = {
+                            event.external_id: event
+                            for event in await db.scalars(stmt, execution_options={"populate_existing": True})
+                        }
+                        processed = [
+                            (ev, upserted.get(event.external_id, event) if not is_update else event, is_update, push_relevant_change)
+                            for ev, event, is_update, push_relevant_change in processed
+                        ]
 
-                        db.add(new_event)
-                        db.commit()                        # Save primary snapshot
-                        snapshot = None
-                        if camera_url:
-                            snapshot = await download_camera_snapshot(camera_url, ev['external_id'], ev.get('county_no', 0), fullsize_url)
-                        
-                        new_event.camera_snapshot = snapshot
-                        db.commit()
-                        db.refresh(new_event)
+                    history_counts = dict((await db.execute(
+                        select(TrafficEventVersion.external_id, func.count(TrafficEventVersion.id))
+                        .where(TrafficEventVersion.external_id.in_([p[1].external_id for p in processed]))
+                        .group_by(TrafficEventVersion.external_id)
+                    )).all())
 
-                    # Notify subscribers for NEW events or SIGNIFICANT updates
-                    # MQTT & Broadcast (Unified for New & Updated)
-                    history_count = db.query(TrafficEventVersion).filter(TrafficEventVersion.external_id == new_event.external_id).count()
-                    
-                    mqtt_data = ev.copy()
-                    mqtt_data['is_update'] = bool(existing)
-                    mqtt_data['update_count'] = history_count
-                    
-                    lat = ev.get('latitude')
-                    lon = ev.get('longitude')
-                    has_weather = any([
-                        new_event.air_temperature is not None,
-                        new_event.wind_speed is not None,
-                        new_event.road_temperature is not None,
-                        new_event.grip is not None,
-                        new_event.ice_depth is not None,
-                        new_event.snow_depth is not None,
-                        new_event.water_equivalent is not None
-                    ])
-                    if has_weather:
-                        mqtt_data["weather"] = {
-                            "air_temperature": new_event.air_temperature,
-                            "wind_speed": new_event.wind_speed,
-                            "wind_direction": new_event.wind_direction,
-                            "road_temperature": new_event.road_temperature,
-                            "grip": new_event.grip,
-                            "ice_depth": new_event.ice_depth,
-                            "snow_depth": new_event.snow_depth,
-                            "water_equivalent": new_event.water_equivalent
-                        }
-                    else:
-                        mqtt_data['weather'] = None
-                    
                     # Fetch base_url for absolute links
-                    base_url_setting = db.query(Settings).filter(Settings.key == "base_url").first()
+                    base_url_setting = await db.scalar(select(Settings).where(Settings.key == "base_url"))
                     base_url = base_url_setting.value if base_url_setting else ""
 
-                    # 1. Sanitize Icon: Use local proxy instead of Trafikverket URL
-                    # Append .png for Home Assistant compatibility
-                    if ev.get('icon_id'):
-                        icon_id_with_ext = f"{ev['icon_id']}.png"
-                        local_icon_url = f"{base_url}/api/icons/{icon_id_with_ext}" if base_url else f"/api/icons/{icon_id_with_ext}"
-                        mqtt_data['icon_url'] = local_icon_url
-                        # Public fallback for users behind Basic Auth
-                        mqtt_data['external_icon_url'] = f"https://api.trafikinfo.trafikverket.se/v1/icons/{ev['icon_id']}?type=png32x32"
-                        # MDI Icon mapping for Home Assistant
-                        mqtt_data['mdi_icon'] = MDI_ICON_MAP.get(ev['icon_id'], "mdi:alert-circle")
+                    # MQTT & Broadcast payloads (Unified for New & Updated): (mqtt_data, event_data, is_update, push_relevant_change, id)
+                    pending = []
+                    for ev, new_event, is_update, push_relevant_change in processed:
+                        history_count = history_counts.get(new_event.external_id, 0)
                     
-                    # 2. Sanitize Cameras: Use local snapshots/proxies
-                    # Use data from the DB to ensure consistency
-                    mqtt_data['camera_name'] = new_event.camera_name
-                    mqtt_data['camera_snapshot'] = new_event.camera_snapshot
+                        mqtt_data = ev.as_dict()
+                        mqtt_data['is_update'] = is_update
+                        mqtt_data['update_count'] = history_count
                     
-                    # Provide absolute snapshot URL for Home Assistant
-                    if new_event.camera_snapshot and base_url:
-                        mqtt_data['snapshot_url'] = f"{base_url}/api/snapshots/{new_event.camera_snapshot}"
-                    else:
-                        mqtt_data['snapshot_url'] = None
+                        lat = ev.latitude
+                        lon = ev.longitude
+                        has_weather = any([
+                            new_event.air_temperature is not None,
+                            new_event.wind_speed is not None,
+                            new_event.road_temperature is not None,
+                            new_event.grip is not None,
+                            new_event.ice_depth is not None,
+                            new_event.snow_depth is not None,
+                            new_event.water_equivalent is not None
+                        ])
+                        if has_weather:
+                            mqtt_data["weather"] = {
+                                "air_temperature": new_event.air_temperature,
+                                "wind_speed": new_event.wind_speed,
+                                "wind_direction": new_event.wind_direction,
+                                "road_temperature": new_event.road_temperature,
+                                "grip": new_event.grip,
+                                "ice_depth": new_event.ice_depth,
+                                "snow_depth": new_event.snow_depth,
+                                "water_equivalent": new_event.water_equivalent
+                            }
+                        else:
+                            mqtt_data['weather'] = None
+
+                        # 1. Sanitize Icon: Use local proxy instead of Trafikverket URL
+                        # Append .png for Home Assistant compatibility
+                        if ev.icon_id:
+                            icon_id_with_ext = f"{ev.icon_id}.png"
+                            local_icon_url = f"{base_url}/api/icons/{icon_id_with_ext}" if base_url else f"/api/icons/{icon_id_with_ext}"
+                            mqtt_data['icon_url'] = local_icon_url
+                            # Public fallback for users behind Basic Auth
+                            mqtt_data['external_icon_url'] = ICON_URL_TEMPLATE.format(ev.icon_id)
+                            # MDI Icon mapping for Home Assistant
+                            mqtt_data['mdi_icon'] = MDI_ICON_MAP.get(ev.icon_id, "mdi:alert-circle")
+                    
+                        # 2. Sanitize Cameras: Use local snapshots/proxies
+                        # Use data from the DB to ensure consistency
+                        mqtt_data['camera_name'] = new_event.camera_name
+                        mqtt_data['camera_snapshot'] = new_event.camera_snapshot
+                    
+                        # Provide absolute snapshot URL for Home Assistant
+                        if new_event.camera_snapshot and base_url:
+                            mqtt_data['snapshot_url'] = f"{base_url}/api/snapshots/{new_event.camera_snapshot}"
+                        else:
+                            mqtt_data['snapshot_url'] = None
                         
-                    # Provide Deep link to the PWA app
-                    if base_url:
-                        mqtt_data['event_url'] = f"{base_url}/?event_id={new_event.external_id}"
-                    else:
-                        mqtt_data['event_url'] = None
+                        # Provide Deep link to the PWA app
+                        if base_url:
+                            mqtt_data['event_url'] = f"{base_url}/?event_id={new_event.external_id}"
+                        else:
+                            mqtt_data['event_url'] = None
 
-                    # Sanitize/Rename Trafikverket camera URL to avoid external leaks
-                    mqtt_data['external_camera_url'] = new_event.camera_url
-                    if 'camera_url' in mqtt_data:
-                        del mqtt_data['camera_url']
+                        # Sanitize/Rename Trafikverket camera URL to avoid external leaks
+                        mqtt_data['external_camera_url'] = new_event.camera_url
+                        if 'camera_url' in mqtt_data:
+                            del mqtt_data['camera_url']
                     
-                    # Sanitize extra cameras
-                    if new_event.extra_cameras:
+                        # Decoded once, shared by the MQTT and frontend payloads
                         try:
-                            extra_list = json.loads(new_event.extra_cameras)
-                            sanitized_extra = []
-                            for c in extra_list:
-                                c_data = {
-                                    "id": c.get("id"),
-                                    "name": c.get("name"),
-                                    "snapshot": c.get("snapshot")
-                                }
-                                if c.get("snapshot") and base_url:
-                                    c_data["snapshot_url"] = f"{base_url}/api/snapshots/{c.get('snapshot')}"
-                                sanitized_extra.append(c_data)
-                            mqtt_data['extra_cameras'] = json.dumps(sanitized_extra)
-                        except:
-                            mqtt_data['extra_cameras'] = None
-
-                    # 4. Region & Timeout
-                    mqtt_data['region'] = COUNTY_MAP.get(new_event.county_no, "Okänd region")
-                    
-                    if new_event.end_time:
-                        now = datetime.now()
-                        # Use naive comparison since both are naive (likely) or ensure both are same
-                        # TrafficEvent.end_time is stored as naive in SQLite
-                        diff = (new_event.end_time - now).total_seconds()
-                        mqtt_data['timeout'] = int(max(0, diff))
-                    else:
-                        mqtt_data['timeout'] = 0
+                            extra_list = orjson.loads(new_event.extra_cameras) if new_event.extra_cameras else []
+                        except orjson.JSONDecodeError:
+                            extra_list = None
 
-                    if mqtt_client.publish_event(mqtt_data):
-                        new_event.pushed_to_mqtt = 1
-                    else:
-                        new_event.pushed_to_mqtt = 0
-                    db.commit()
-
-                    # Notify subscribers for NEW events or SIGNIFICANT updates
-                    if not existing or push_relevant_change:
-                        await notify_subscribers(mqtt_data, db, type="event")
-
-                    # Broadcast to connected frontend clients
-                    event_data = {
-                        "id": new_event.id,
-                        "external_id": new_event.external_id,
-                        "is_update": bool(existing),
-                        "update_count": history_count,
-                        "title": new_event.title,
-                        "description": new_event.description,
-                        "location": new_event.location,
-                        "icon_url": mqtt_data.get('icon_url'),
-                        "created_at": new_event.created_at.isoformat(),
-                        "updated_at": new_event.updated_at.isoformat() if new_event.updated_at else new_event.created_at.isoformat(),
-                        "pushed_to_mqtt": bool(new_event.pushed_to_mqtt),
-                        "message_type": new_event.message_type,
-                        "severity_code": new_event.severity_code,
-                        "severity_text": new_event.severity_text,
-                        "road_number": new_event.road_number,
-                        "start_time": new_event.start_time.isoformat() if new_event.start_time else None,
-                        "end_time": new_event.end_time.isoformat() if new_event.end_time else None,
-                        "temporary_limit": new_event.temporary_limit,
-                        "traffic_restriction_type": new_event.traffic_restriction_type,
-                        "latitude": new_event.latitude,
-                        "longitude": new_event.longitude,
-                        "county_no": new_event.county_no,
-                        "camera_url": new_event.camera_url,
-                        "camera_name": new_event.camera_name,
-                        "camera_snapshot": new_event.camera_snapshot,
-                        "extra_cameras": json.loads(new_event.extra_cameras) if new_event.extra_cameras else [],
-                        "history_count": history_count,
-                        "weather": mqtt_data.get('weather')
-                    }
-                    for queue in connected_clients:
-                        await queue.put(event_data)
+                        # Sanitize extra cameras
+                        if new_event.extra_cameras:
+                            try:
+                                sanitized_extra = []
+                                for c in extra_list:
+                                    c_data = {
+                                        "id": c.get("id"),
+                                        "name": c.get("name"),
+                                        "snapshot": c.get("snapshot")
+                                    }
+                                    if c.get("snapshot") and base_url:
+                                        c_data["snapshot_url"] = f"{base_url}/api/snapshots/{c.get('snapshot')}"
+                                    sanitized_extra.append(c_data)
+                                mqtt_data['extra_cameras'] = orjson.dumps(sanitized_extra).decode()
+                            except:
+                                mqtt_data['extra_cameras'] = None
 
-                    db.commit()
-            except Exception as e:
-                logger.error(f"Error processing events: {e}")
-            finally:
-                db.close()
+                        # 4. Region & Timeout
+                        mqtt_data['region'] = COUNTY_MAP.get(new_event.county_no, "Okänd region")
+                    
+                        if new_event.end_time:
+                            now = datetime.now()
+                            # Use naive comparison since both are naive (likely) or ensure both are same
+                            # TrafficEvent.end_time is stored as naive in SQLite
+                            diff = (new_event.end_time - now).total_seconds()
+                            mqtt_data['timeout'] = int(max(0, diff))
+                        else:
+                            mqtt_data['timeout'] = 0
+
+                        # Frontend broadcast payload, pushed_to_mqtt is filled in after publishing
+                        event_data = {
+                            "id": new_event.id,
+                            "external_id": new_event.external_id,
+                            "is_update": is_update,
+                            "update_count": history_count,
+                            "title": new_event.title,
+                            "description": new_event.description,
+                            "location": new_event.location,
+                            "icon_url": mqtt_data.get('icon_url'),
+                            "created_at": new_event.created_at.isoformat(),
+                            "updated_at": new_event.updated_at.isoformat() if new_event.updated_at else new_event.created_at.isoformat(),
+                            "pushed_to_mqtt": False,
+                            "message_type": new_event.message_type,
+                            "severity_code": new_event.severity_code,
+                            "severity_text": new_event.severity_text,
+                            "road_number": new_event.road_number,
+                            "start_time": new_event.start_time.isoformat() if new_event.start_time else None,
+                            "end_time": new_event.end_time.isoformat() if new_event.end_time else None,
+                            "temporary_limit": new_event.temporary_limit,
+                            "traffic_restriction_type": new_event.traffic_restriction_type,
+                            "latitude": new_event.latitude,
+                            "longitude": new_event.longitude,
+                            "county_no": new_event.county_no,
+                            "camera_url": new_event.camera_url,
+                            "camera_name": new_event.camera_name,
+                            "camera_snapshot": new_event.camera_snapshot,
+                            "extra_cameras": extra_list if extra_list is not None else [],
+                            "history_count": history_count,
+                            "weather": mqtt_data.get('weather')
+                        }
+                        pending.append((mqtt_data, event_data, is_update, push_relevant_change, new_event.id))
+
+                    # MQTT goes out from mqtt_pump; mark the events as pushed optimistically,
+                    # the pump resets the flag for anything that fails to publish
+                    mqtt_queued = mqtt_client.connected
+                    await db.execute(
+                        update(TrafficEvent)
+                        .where(TrafficEvent.id.in_([p[4] for p in pending]))
+                        # Keep updated_at as-is, the MQTT flag is bookkeeping and not an event change
+                        .values(pushed_to_mqtt=1 if mqtt_queued else 0, updated_at=TrafficEvent.updated_at)
+                    )
+                    await db.commit()
+
+                    if mqtt_queued:
+                        dropped_ids = []
+                        for mqtt_data, _, _, _, event_id in pending:
+                            try:
+                                mqtt_out.put_nowait((event_id, mqtt_data))
+                            except asyncio.QueueFull:
+                                dropped_ids.append(event_id)
+                        if dropped_ids:
+                            logger.warning(f"MQTT queue full, skipping publish of {len(dropped_ids)} events")
+                            await asyncio.to_thread(reset_mqtt_flags, dropped_ids)
+
+                    # Push subscriptions are still handled through a sync session
+                    push_db = None
+                    try:
+                        for mqtt_data, event_data, is_update, push_relevant_change, event_id in pending:
+                            # Notify subscribers for NEW events or SIGNIFICANT updates
+                            if not is_update or push_relevant_change:
+                                if push_db is None:
+                                    push_db = SessionLocal()
+                                await notify_subscribers(mqtt_data, push_db, type="event")
+
+                            # Broadcast to connected frontend clients
+                            event_data["pushed_to_mqtt"] = mqtt_queued
+                            await event_fanout.publish(event_data)
+                    finally:
+                        if push_db is not None:
+                            push_db.close()
+                except Exception as e:
+                    logger.error(f"Error processing events: {e}")
+                finally:
+                    await db.close()
     except asyncio.CancelledError:
         logger.debug("Event processor cancelled")
     except Exception as e:
@@ -1482,9 +1680,10 @@ async def road_condition_processor():
     global rc_stream, cameras
     try:
         async for raw_data in rc_stream.get_events():
-            conditions = parse_road_condition(raw_data)
+            conditions = await asyncio.get_running_loop().run_in_executor(parse_executor, parse_road_condition, raw_data)
             
-            db = SessionLocal()
+            # Rows are only read back after commit to build the broadcast, which this session just wrote
+            db = SessionLocal(expire_on_commit=False)
             try:
                 # Get camera radius setting
                 radius_setting = db.query(Settings).filter(Settings.key == "camera_radius_km").first()
@@ -1622,7 +1821,7 @@ async def road_condition_processor():
                         if rc.get('pushed_to_mqtt'):
                              existing.pushed_to_mqtt = 1
 
-                        db.commit()
+                        await commit_off_loop(db)
                         final_rc = existing
                     else:
                         # Create new Road Condition
@@ -1713,7 +1912,7 @@ async def road_condition_processor():
                         
                         db.add(final_rc)
                         db.add(version)
-                        db.commit()
+                        await commit_off_loop(db)
 
                     # Prepare data for broadcast
                     icon_url = None
@@ -1787,8 +1986,7 @@ async def road_condition_processor():
                         await notify_subscribers(condition_data, db, type="road_condition")
 
                     # Broadcast to connected clients 
-                    for queue in connected_clients:
-                         await queue.put(condition_data)
+                    await event_fanout.publish(condition_data)
                     
                     # Publish to MQTT if enabled
                     mqtt_rc_enabled_setting = db.query(Settings).filter(Settings.key == "mqtt_rc_enabled").first()
@@ -1803,8 +2001,7 @@ async def road_condition_processor():
                              # Add requested fields
                              mqtt_payload['county_no'] = final_rc.county_no
                              mqtt_payload['external_id'] = final_rc.id
-                             import json
-                             mqtt_client.publish(mqtt_rc_topic, json.dumps(mqtt_payload, default=str))
+                             mqtt_client.publish(mqtt_rc_topic, orjson.dumps(mqtt_payload, default=str))
                              logger.info(f"Published RoadCondition to MQTT: {final_rc.id}")
                          except Exception as e:
                              logger.error(f"Failed to publish road condition to MQTT: {e}")
@@ -1819,24 +2016,58 @@ async def road_condition_processor():
     except Exception as e:
         logger.error(f"RoadCondition processor error: {e}")
 
-# Global list of connected SSE clients
-connected_clients = []
+class FanoutBuffer:
+    """Shared ring buffer for the SSE broadcast. Every client reads it with its own cursor,
+    so publishing is O(1) and each event is kept in memory once."""
+    def __init__(self, capacity=4096, max_backlog=256):
+        self.buf = deque(maxlen=capacity)
+        self.max_backlog = max_backlog
+        self.cond = asyncio.Condition()
+        self.seq = 0
+        self.subscribers = 0
+
+    async def publish(self, data):
+        # Encoded to a complete SSE frame once here; every client sends the same bytes
+        payload = ServerSentEvent(data=orjson.dumps(data).decode()).encode()
+        async with self.cond:
+            self.buf.append((self.seq, payload))
+            self.seq += 1
+            self.cond.notify_all()
+
+    async def read(self, cursor):
+        """Waits until there is something after cursor. Returns (entries, new_cursor)."""
+        async with self.cond:
+            await self.cond.wait_for(lambda: cursor < self.seq)
+            # A slow client gets at most max_backlog entries, the oldest ones are dropped
+            first_seq = self.buf[0][0]
+            start = max(cursor, first_seq, self.seq - self.max_backlog) - first_seq
+            return [data for _, data in itertools.islice(self.buf, start, None)], self.seq
+
+# Global broadcast buffer for connected SSE clients
+event_fanout = FanoutBuffer()
 
 @app.get("/api/stream")
 async def stream_events(user=Depends(require_app_auth)):
-    queue = asyncio.Queue()
-    connected_clients.append(queue)
+    cursor = event_fanout.seq
     
     async def event_generator():
+        nonlocal cursor
+        event_fanout.subscribers += 1
         try:
             while True:
-                data = await queue.get()
-                yield json.dumps(data)
-        except asyncio.CancelledError:
-            connected_clients.remove(queue)
-
-    from sse_starlette.sse import EventSourceResponse
-    return EventSourceResponse(event_generator())
+                entries, cursor = await event_fanout.read(cursor)
+                for payload in entries:
+                    yield payload
+        finally:
+            event_fanout.subscribers -= 1
+
+    return EventSourceResponse(
+        event_generator(),
+        ping=15,
+        # Drop clients that stop reading instead of blocking on them
+        send_timeout=30,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.get("/api/events/{external_id}/history")
@@ -1849,7 +2080,7 @@ async def get_event_history(external_id: str, db: Session = Depends(get_db), use
         extra_cams = []
         if v.extra_cameras:
             try:
-                raw_extra = json.loads(v.extra_cameras)
+                raw_extra = orjson.loads(v.extra_cameras)
                 for c in raw_extra:
                     extra_cams.append({
                         "id": c.get("id"),
@@ -2038,14 +2269,13 @@ async def proxy_icon(icon_id: str):
         return FileResponse(icon_path, media_type="image/png")
         
     # Otherwise fetch and save
-    url = f"https://api.trafikinfo.trafikverket.se/v1/icons/{icon_id}?type=png32x32"
+    url = ICON_URL_TEMPLATE.format(icon_id)
     try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(url)
-            if response.status_code == 200:
-                with open(icon_path, "wb") as f:
-                    f.write(response.content)
-                return FileResponse(icon_path, media_type="image/png")
+        response = await get_media_client().get(url, timeout=5.0)
+        if response.status_code == 200:
+            with open(icon_path, "wb") as f:
+                f.write(response.content)
+            return FileResponse(icon_path, media_type="image/png")
     except Exception as e:
         logger.error(f"Error proxying icon {icon_id}: {e}")
         
@@ -2067,23 +2297,36 @@ async def proxy_camera_image(camera_id: str, fullsize: bool = False):
         db.close()
         
     async def stream_image():
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            try:
-                async with client.stream("GET", url) as response:
-                    if response.status_code != 200:
-                        yield b""
-                        return
-                    async for chunk in response.aiter_bytes():
-                        yield chunk
-            except Exception as e:
-                logger.error(f"Error proxying camera {camera_id}: {e}")
-                yield b""
+        try:
+            async with get_media_client().stream("GET", url, timeout=10.0) as response:
+                if response.status_code != 200:
+                    yield b""
+                    return
+                async for chunk in response.aiter_bytes():
+                    yield chunk
+        except Exception as e:
+            logger.error(f"Error proxying camera {camera_id}: {e}")
+            yield b""
 
     return StreamingResponse(stream_image(), media_type="image/jpeg")
 
-@app.get("/api/events", response_model=List[dict])
-def get_events(limit: int = 50, offset: int = 0, hours: int = None, date: str = None, counties: str = None, type: str = "realtid", db: Session = Depends(get_db), user=Depends(require_app_auth)):
-    query = db.query(TrafficEvent)
+# Columns serialized by /api/events
+EVENT_LIST_COLUMNS = (
+    TrafficEvent.id, TrafficEvent.external_id, TrafficEvent.title, TrafficEvent.description,
+    TrafficEvent.location, TrafficEvent.icon_id, TrafficEvent.created_at, TrafficEvent.updated_at,
+    TrafficEvent.pushed_to_mqtt, TrafficEvent.message_type, TrafficEvent.severity_code,
+    TrafficEvent.severity_text, TrafficEvent.road_number, TrafficEvent.start_time, TrafficEvent.end_time,
+    TrafficEvent.temporary_limit, TrafficEvent.traffic_restriction_type, TrafficEvent.latitude,
+    TrafficEvent.longitude, TrafficEvent.county_no, TrafficEvent.camera_snapshot, TrafficEvent.extra_cameras,
+    TrafficEvent.air_temperature, TrafficEvent.wind_speed, TrafficEvent.wind_direction
+)
+
+@app.get("/api/events")
+async def get_events(limit: int = 50, offset: int = 0, before: Optional[datetime] = None, before_id: Optional[int] = None, hours: int = None, date: str = None, counties: str = None, type: str = "realtid", db: AsyncSession = Depends(get_async_db), user=Depends(require_app_auth)):
+    """Lists events, most recently updated first. With `before` (start at the current time) it
+    pages newest-created first and returns the next cursor in X-Next-Before/X-Next-Before-Id."""
+    # Only load the columns the response uses
+    query = select(TrafficEvent).options(load_only(*EVENT_LIST_COLUMNS))
     
     # Filter by counties if provided (comma separated)
     if counties:
@@ -2133,15 +2376,12 @@ def get_events(limit: int = 50, offset: int = 0, hours: int = None, date: str =
                 # Planned = Future starts (> 1 min) OR Long-term (>= 5 days)
                 query = query.filter(
                     (TrafficEvent.start_time > grace_now) | 
-                    (func.julianday(TrafficEvent.end_time) - func.julianday(TrafficEvent.start_time) >= 5)
+                    (TrafficEvent.long_duration == 1)
                 )
             else: # realtid (default)
                 # Realtid = Started (or starts <= 1 min) AND Short-term (< 5 days)
                 query = query.filter(TrafficEvent.start_time <= grace_now)
-                query = query.filter(
-                    (TrafficEvent.end_time == None) | 
-                    (func.julianday(TrafficEvent.end_time) - func.julianday(TrafficEvent.start_time) < 5)
-                )
+                query = query.filter(TrafficEvent.long_duration == 0)
         
         # Apply time window if specified (hours > 0)
         # If hours=0 (All History), no cutoff is applied
@@ -2149,15 +2389,32 @@ def get_events(limit: int = 50, offset: int = 0, hours: int = None, date: str =
             cutoff = datetime.now() - timedelta(hours=hours)
             query = query.filter(TrafficEvent.created_at >= cutoff)
         
-    events = query.order_by(TrafficEvent.updated_at.desc(), TrafficEvent.created_at.desc()).offset(offset).limit(limit).all()
+    if before_id is not None and before is None:
+        # before_id only breaks created_at ties; on its own it would page in a different order than the feed
+        raise HTTPException(status_code=400, detail="before_id requires before")
+
+    if before is not None:
+        # Keyset pagination on (created_at, id), served by ix_te_created_at_id (no OFFSET scan)
+        if before.tzinfo is not None:
+            # created_at is stored as naive local time, so convert aware cursors before dropping the offset
+            before = before.astimezone().replace(tzinfo=None)
+        cursor_filter = TrafficEvent.created_at < before
+        if before_id is not None:
+            cursor_filter = or_(cursor_filter, and_(TrafficEvent.created_at == before, TrafficEvent.id < before_id))
+        query = query.filter(cursor_filter).order_by(TrafficEvent.created_at.desc(), TrafficEvent.id.desc())
+    else:
+        query = query.order_by(TrafficEvent.updated_at.desc(), TrafficEvent.created_at.desc()).offset(offset)
+    events = (await db.scalars(query.limit(limit))).all()
     
     # Batch fetch history counts to avoid N+1 queries
     external_ids = [e.external_id for e in events]
     history_counts = {}
     if external_ids:
-        h_counts = db.query(TrafficEventVersion.external_id, func.count(TrafficEventVersion.id))\
-                    .filter(TrafficEventVersion.external_id.in_(external_ids))\
-                    .group_by(TrafficEventVersion.external_id).all()
+        h_counts = await db.execute(
+            select(TrafficEventVersion.external_id, func.count(TrafficEventVersion.id))
+            .where(TrafficEventVersion.external_id.in_(external_ids))
+            .group_by(TrafficEventVersion.external_id)
+        )
         history_counts = {ext_id: count for ext_id, count in h_counts}
 
     result = []
@@ -2166,7 +2423,7 @@ def get_events(limit: int = 50, offset: int = 0, hours: int = None, date: str =
         extra_cams = []
         if e.extra_cameras:
             try:
-                raw_extra = json.loads(e.extra_cameras)
+                raw_extra = orjson.loads(e.extra_cameras)
                 for c in raw_extra:
                     extra_cams.append({
                         "id": c.get("id"),
@@ -2206,7 +2463,15 @@ def get_events(limit: int = 50, offset: int = 0, hours: int = None, date: str =
                 "wind_direction": e.wind_direction
             } if e.air_temperature is not None else None
         })
-    return result
+
+    # Cursor for the next (created_at, id) page, the body stays a plain list
+    headers = None
+    if before is not None and len(events) == limit and events[-1].created_at:
+        headers = {
+            "X-Next-Before": events[-1].created_at.isoformat(),
+            "X-Next-Before-Id": str(events[-1].id)
+        }
+    return orjson_response(result, headers=headers)
 
 
 @app.get("/api/road-conditions")
@@ -2271,7 +2536,7 @@ async def get_road_conditions(county_no: str = None, limit: int = 100, offset: i
     } for c in conditions]
 
 @app.get("/api/stats")
-def get_stats(hours: int = None, date: str = None, db: Session = Depends(get_db), user=Depends(require_app_auth)):
+async def get_stats(hours: int = None, date: str = None, db: AsyncSession = Depends(get_async_db), user=Depends(require_app_auth)):
     from datetime import datetime, timedelta, time
     
     if date:
@@ -2289,34 +2554,34 @@ def get_stats(hours: int = None, date: str = None, db: Session = Depends(get_db)
         start_time = datetime.combine(datetime.now().date(), time.min)
         end_time = datetime.now()
     
-    # Base query for time range
-    base_query = db.query(TrafficEvent).filter(
-        TrafficEvent.created_at >= start_time,
-        TrafficEvent.created_at <= end_time
-    )
-    
-    # Total count
-    total_events = base_query.count()
+    in_range = (TrafficEvent.created_at >= start_time, TrafficEvent.created_at <= end_time)
     
     # Count by Message Type
-    type_counts = db.query(TrafficEvent.message_type, func.count(TrafficEvent.id))\
-        .filter(TrafficEvent.created_at >= start_time, TrafficEvent.created_at <= end_time)\
-        .group_by(TrafficEvent.message_type).all()
+    type_counts = (await db.execute(
+        select(TrafficEvent.message_type, func.count(TrafficEvent.id))
+        .where(*in_range)
+        .group_by(TrafficEvent.message_type)
+    )).all()
         
     # Count by Severity
-    severity_counts = db.query(TrafficEvent.severity_text, func.count(TrafficEvent.id))\
-        .filter(TrafficEvent.created_at >= start_time, TrafficEvent.created_at <= end_time)\
-        .group_by(TrafficEvent.severity_text).all()
+    severity_counts = (await db.execute(
+        select(TrafficEvent.severity_text, func.count(TrafficEvent.id))
+        .where(*in_range)
+        .group_by(TrafficEvent.severity_text)
+    )).all()
+    
+    # Total count (every event falls in exactly one message type group)
+    total_events = sum(t[1] for t in type_counts)
         
-    # Events over time (grouped by hour)
-    events = base_query.with_entities(TrafficEvent.created_at).all()
-    
-    timeline = {}
-    for e in events:
-        key = e.created_at.strftime("%Y-%m-%d %H:00")
-        timeline[key] = timeline.get(key, 0) + 1
+    # Events over time (grouped by hour in SQLite)
+    hour_expr = func.strftime("%Y-%m-%d %H:00", TrafficEvent.created_at).label("hour")
+    timeline = (await db.execute(
+        select(hour_expr, func.count(TrafficEvent.id))
+        .where(*in_range)
+        .group_by(hour_expr).order_by(hour_expr)
+    )).all()
         
-    sorted_timeline = [{"time": k, "count": v} for k, v in sorted(timeline.items())]
+    sorted_timeline = [{"time": t[0], "count": t[1]} for t in timeline]
 
     return {
         "total": total_events,
@@ -2326,31 +2591,40 @@ def get_stats(hours: int = None, date: str = None, db: Session = Depends(get_db)
         "date": date or datetime.now().strftime("%Y-%m-%d")
     }
 
+# All settings as a key-value dict, cleared by every settings write in this process.
+# The TTL only matters for rows changed outside save_settings/update_settings.
+settings_cache = {"data": None, "expires": 0.0}
+SETTINGS_CACHE_TTL = 30
+
+def invalidate_settings_cache():
+    settings_cache["data"] = None
+
 @app.get("/api/settings")
 async def get_settings(db: Session = Depends(get_db), user=Depends(require_app_auth)):
     """Returns all settings as a key-value dict for the frontend."""
-    all_settings = db.query(Settings).all()
-    return {s.key: s.value for s in all_settings}
+    if settings_cache["data"] is None or time.time() >= settings_cache["expires"]:
+        settings_cache["data"] = {s.key: s.value for s in db.query(Settings).all()}
+        settings_cache["expires"] = time.time() + SETTINGS_CACHE_TTL
+    return dict(settings_cache["data"])
+
+def save_settings(db: Session, values: dict):
+    # Single upsert statement for all keys
+    stmt = sqlite_insert(Settings).values([{"key": k, "value": v} for k, v in values.items()])
+    db.execute(stmt.on_conflict_do_update(index_elements=["key"], set_={"value": stmt.excluded.value}))
+    db.commit()
 
 @app.post("/api/settings")
 async def update_settings(settings: dict, db: Session = Depends(get_db), user=Depends(require_app_auth)):
     try:
-        for k, v in settings.items():
-            # Convert value to string to ensure compatibility with Settings model
-            str_value = str(v) if v is not None else ""
-            
-            s = db.query(Settings).filter(Settings.key == k).first()
-            if s:
-                s.value = str_value
-            else:
-                s = Settings(key=k, value=str_value)
-                db.add(s)
-        db.commit()
+        # Convert values to string to ensure compatibility with Settings model
+        values = {k: str(v) if v is not None else "" for k, v in settings.items()}
+        if values:
+            await asyncio.to_thread(save_settings, db, values)
+            invalidate_settings_cache()
         
         if "api_key" in settings:
-            # Re-fetch key to restart manager if changed
-            curr_key = db.query(Settings).filter(Settings.key == "api_key").first()
-            api_key = curr_key.value if curr_key else ""
+            # Restart manager if the key changed
+            api_key = values["api_key"]
             
             global dynamic_worker_task
             if not dynamic_worker_task or dynamic_worker_task.done():
@@ -2378,7 +2652,7 @@ async def update_settings(settings: dict, db: Session = Depends(get_db), user=De
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/api/report-base-url")
-async def report_base_url(payload: dict, db: Session = Depends(get_db), user=Depends(require_app_auth)):
+def report_base_url(payload: dict, db: Session = Depends(get_db), user=Depends(require_app_auth)):
     """Automatically update the base_url from frontend origin."""
     base_url = payload.get("base_url")
     if not base_url:
@@ -2391,10 +2665,12 @@ async def report_base_url(payload: dict, db: Session = Depends(get_db), user=Dep
             logger.info(f"Updating base_url: {existing.value} -> {base_url}")
             existing.value = base_url
             db.commit()
+            invalidate_settings_cache()
     else:
         logger.info(f"Setting initial base_url: {base_url}")
         db.add(Settings(key="base_url", value=base_url))
         db.commit()
+        invalidate_settings_cache()
         
     return {"status": "ok", "base_url": base_url}
 
@@ -2441,6 +2717,7 @@ def get_vapid_keys(db: Session):
                 logger.info("Updating VAPID private key in DB with normalized PKCS8 format.")
                 private_key_setting.value = clean_private_pem
                 db.commit()
+                invalidate_settings_cache()
             
             clean_public_b64 = public_key_setting.value.strip()
             
@@ -2485,6 +2762,7 @@ def get_vapid_keys(db: Session):
             public_key_setting.value = clean_public_b64
             
         db.commit()
+        invalidate_settings_cache()
         logger.info("VAPID keys generated/updated successfully.")
         
     return clean_private_pem, clean_public_b64
@@ -2533,7 +2811,7 @@ class ClientInterestRequest(BaseModel):
     counties: str
 
 @app.post("/api/client/interest")
-async def register_client_interest(payload: ClientInterestRequest, db: Session = Depends(get_db), user=Depends(require_app_auth)):
+def register_client_interest(payload: ClientInterestRequest, db: Session = Depends(get_db), user=Depends(require_app_auth)):
     """Register user's current county interest (Family Model)"""
     try:
         interest = db.query(ClientInterest).filter(ClientInterest.client_id == payload.client_id).first()
@@ -2580,7 +2858,7 @@ def mute_subscription(payload: dict, db: Session = Depends(get_db)):
     return {"status": "error", "message": "Subscription not found"}
 
 async def send_push_notification(subscription: PushSubscription, title: str, message: str, url: str, db: Session, icon: str = None, image: str = None, ttl: int = 7200):
-    private_key_pem, _ = get_vapid_keys(db)
+    private_key_pem, _ = await asyncio.to_thread(get_vapid_keys, db)
     
     try:
         # EXPLICIT VAPID OBJECT: Bypass pywebpush string parsing which is causing ASN.1 errors
@@ -2623,7 +2901,7 @@ async def send_push_notification(subscription: PushSubscription, title: str, mes
             logger.warning(f"Removing invalid subscription (Status: {ex.response.status_code}): {subscription.endpoint}")
             # Ensure we use a fresh session or the provided session is still valid
             db.delete(subscription)
-            db.commit()
+            await commit_off_loop(db)
         else:
             logger.error(f"Push failed (Status: {ex.response.status_code if ex.response else 'N/A'}): {ex}")
     except (ValueError, TypeError) as e:
@@ -2631,7 +2909,7 @@ async def send_push_notification(subscription: PushSubscription, title: str, mes
         logger.error(f"Invalid key data for subscription {subscription.id}: {e}")
         logger.info(f"Removing corrupt subscription: {subscription.endpoint}")
         db.delete(subscription)
-        db.commit()
+        await commit_off_loop(db)
     except Exception as e:
         # Catch generic errors but check string for "deserialize"
         err_str = str(e)
@@ -2639,7 +2917,7 @@ async def send_push_notification(subscription: PushSubscription, title: str, mes
              logger.error(f"Crypto error for subscription {subscription.id}: {e}")
              logger.info(f"Removing incompatible subscription: {subscription.endpoint}")
              db.delete(subscription)
-             db.commit()
+             await commit_off_loop(db)
         else:
              logger.error(f"Unexpected push error: {e}")
 
@@ -2857,7 +3135,7 @@ def get_admin_clients(db: Session = Depends(get_db), admin=Depends(get_current_a
             "include_weather": bool(s.include_weather),
             "rc_warning_filter": s.rc_warning_filter
         } for s in subs],
-        "sse_clients_count": len(connected_clients)
+        "sse_clients_count": event_fanout.subscribers
     }
 
 @app.delete("/api/admin/push-subscriptions/{sub_id}")
@@ -2879,15 +3157,70 @@ def get_settings(db: Session = Depends(get_db), admin=Depends(get_current_admin)
         res["api_key"] = "" # Secret removed for GitHub safety
     return res
 
+# Badge counts as one statement, built once at import; the since_* filters are optional binds
+_badge_now = bindparam("now", type_=DateTime)
+_badge_grace_now = bindparam("grace_now", type_=DateTime)
+_badge_s_feed = bindparam("s_feed", type_=DateTime)
+_badge_s_planned = bindparam("s_planned", type_=DateTime)
+_badge_s_rc = bindparam("s_rc", type_=DateTime)
+
+_badge_active_event = or_(TrafficEvent.end_time == None, TrafficEvent.end_time > _badge_now)
+
+_BADGE_STMT = select(
+    # Realtid: Started (or starts <= 1 min) AND Short-term (< 5 days)
+    select(func.count(TrafficEvent.id)).where(
+        _badge_active_event,
+        TrafficEvent.start_time <= _badge_grace_now,
+        TrafficEvent.long_duration == 0,
+        or_(_badge_s_feed.is_(None), TrafficEvent.created_at > _badge_s_feed)
+    ).scalar_subquery().label("feed"),
+    # Planned: Future starts (> 1 min) OR Long-term (>= 5 days)
+    # For planned, we care about when they were added to the system
+    select(func.count(TrafficEvent.id)).where(
+        _badge_active_event,
+        or_(TrafficEvent.start_time > _badge_grace_now, TrafficEvent.long_duration == 1),
+        or_(_badge_s_planned.is_(None), TrafficEvent.created_at > _badge_s_planned)
+    ).scalar_subquery().label("planned"),
+    # Road Conditions
+    select(func.count(RoadCondition.id)).where(
+        or_(RoadCondition.end_time == None, RoadCondition.end_time > _badge_now),
+        or_(_badge_s_rc.is_(None), RoadCondition.timestamp > _badge_s_rc)
+    ).scalar_subquery().label("road_conditions")
+)
+
+badge_cache = {} # (since_feed, since_planned, since_road_conditions) -> {"data": dict, "etag": str, "expires": float}
+BADGE_CACHE_TTL = 5
+# The endpoint is sync, so concurrent requests update the cache from threadpool threads
+badge_cache_lock = threading.Lock()
+
 @app.get("/api/status/counts")
 def get_status_counts(
+    request: Request,
     since_feed: str = None, 
     since_planned: str = None, 
     since_road_conditions: str = None,
     db: Session = Depends(get_db),
     user=Depends(require_app_auth)
 ):
-    from datetime import datetime
+    cache_key = (since_feed, since_planned, since_road_conditions)
+    cached = badge_cache.get(cache_key)
+    if not cached or time.time() >= cached["expires"]:
+        data = compute_status_counts(db, since_feed, since_planned, since_road_conditions)
+        etag = '"' + hashlib.md5(json.dumps(data, sort_keys=True).encode()).hexdigest() + '"'
+        # Drop expired entries, every client polls with its own since_* values
+        now_ts = time.time()
+        with badge_cache_lock:
+            for key in [k for k, v in badge_cache.items() if now_ts >= v["expires"]]:
+                del badge_cache[key]
+            cached = badge_cache[cache_key] = {"data": data, "etag": etag, "expires": now_ts + BADGE_CACHE_TTL}
+
+    headers = {"ETag": cached["etag"], "Cache-Control": "private, no-cache"}
+    if request.headers.get("if-none-match") == cached["etag"]:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(cached["data"], headers=headers)
+
+def compute_status_counts(db: Session, since_feed: str, since_planned: str, since_road_conditions: str):
+    # Naive local time, matching how timestamps are stored
     now = datetime.now()
     
     def parse_since(since_str):
@@ -2899,53 +3232,27 @@ def get_status_counts(
         except:
             return None
 
-    s_feed = parse_since(since_feed)
-    s_planned = parse_since(since_planned)
-    s_rc = parse_since(since_road_conditions)
-
-    # Base query for non-expired events
-    active_events_query = db.query(TrafficEvent).filter((TrafficEvent.end_time == None) | (TrafficEvent.end_time > now))
-    
-    # Threshold: now + 1 minute grace period
-    grace_now = now + timedelta(minutes=1)
-
-    # Realtid: Started (or starts <= 1 min) AND Short-term (< 5 days)
-    realtid_q = active_events_query.filter(
-        TrafficEvent.start_time <= grace_now
-    ).filter(
-        (TrafficEvent.end_time == None) | 
-        (func.julianday(TrafficEvent.end_time) - func.julianday(TrafficEvent.start_time) < 5)
-    )
-    if s_feed:
-        realtid_q = realtid_q.filter(TrafficEvent.created_at > s_feed)
-    realtid_count = realtid_q.count()
-    
-    # Planned: Future starts (> 1 min) OR Long-term (>= 5 days)
-    planned_q = active_events_query.filter(
-        (TrafficEvent.start_time > grace_now) | 
-        (func.julianday(TrafficEvent.end_time) - func.julianday(TrafficEvent.start_time) >= 5)
-    )
-    if s_planned:
-        # For planned, we care about when they were added to the system
-        planned_q = planned_q.filter(TrafficEvent.created_at > s_planned)
-    planned_count = planned_q.count()
-    
-    # Road Conditions
-    rc_q = db.query(RoadCondition).filter((RoadCondition.end_time == None) | (RoadCondition.end_time > now))
-    if s_rc:
-        rc_q = rc_q.filter(RoadCondition.timestamp > s_rc)
-    rc_count = rc_q.count()
+    counts = db.execute(_BADGE_STMT, {
+        "now": now,
+        # Threshold: now + 1 minute grace period
+        "grace_now": now + timedelta(minutes=1),
+        "s_feed": parse_since(since_feed),
+        "s_planned": parse_since(since_planned),
+        "s_rc": parse_since(since_road_conditions)
+    }).one()
     
     return {
-        "feed": realtid_count,
-        "planned": planned_count,
-        "road-conditions": rc_count,
+        "feed": counts.feed,
+        "planned": counts.planned,
+        "road-conditions": counts.road_conditions,
         "cameras": 0 # Removed per user request
     }
 
 @app.get("/api/status")
-def get_status(db: Session = Depends(get_db), user=Depends(require_app_auth)):
+def get_status(response: Response, db: Session = Depends(get_db), user=Depends(require_app_auth)):
     global tv_stream
+    # Header, sidebar and app poll this at the same time; let the browser share one answer briefly
+    response.headers["Cache-Control"] = "private, max-age=5"
     api_key = db.query(Settings).filter(Settings.key == "api_key").first()
     
     return {
@@ -2964,9 +3271,16 @@ def get_status(db: Session = Depends(get_db), user=Depends(require_app_auth)):
         "cleanup": "running"
     }
 
+_VERSION_JSON = json.dumps({"version": VERSION})
+_VERSION_ETAG = f'"{VERSION}"'
+
 @app.get("/api/version")
-def get_version(user=Depends(require_app_auth)):
-    return {"version": VERSION}
+def get_version(request: Request, user=Depends(require_app_auth)):
+    # Short max-age: the SPA compares this against localStorage to show the changelog after upgrades
+    headers = {"Cache-Control": "private, max-age=300", "ETag": _VERSION_ETAG}
+    if request.headers.get("if-none-match") == _VERSION_ETAG:
+        return Response(status_code=304, headers=headers)
+    return Response(content=_VERSION_JSON, media_type="application/json", headers=headers)
 
 @app.get("/api/changelog")
 def get_changelog(user=Depends(require_app_auth)):
@@ -3034,7 +3348,9 @@ async def simulate_event(
 @app.get("/api/debug/push-test")
 async def debug_push_test(db: Session = Depends(get_db), admin=Depends(get_current_admin)):
     """Triggers a manual push notification test using the last event in DB."""
-    last_event = db.query(TrafficEvent).order_by(TrafficEvent.id.desc()).first()
+    last_event = await asyncio.to_thread(
+        lambda: db.query(TrafficEvent).order_by(TrafficEvent.id.desc()).first()
+    )
     if not last_event:
         return {"error": "No events in DB"}
     
@@ -3055,6 +3371,49 @@ async def debug_push_test(db: Session = Depends(get_db), admin=Depends(get_curre
 class ResetRequest(BaseModel):
     confirm: bool
 
+def _do_reset(db: Session):
+    """Blocking part of the factory reset, run in a worker thread."""
+    # 1. Clear dynamic tables
+    db.query(TrafficEvent).delete()
+    db.query(TrafficEventVersion).delete()
+    db.query(Camera).delete()
+    db.query(RoadCondition).delete()
+    db.query(ClientInterest).delete()
+    db.query(PushSubscription).delete()
+    
+    # 2. Reset specific settings to required defaults 
+    # (while preserving api_key, mqtt_*, admin_password)
+    resets = {
+        "push_notifications_enabled": "false",
+        "sound_notifications_enabled": "false",
+        "selected_counties": "1", # Stockholms Län
+        "camera_radius_km": "8.0",
+        "retention_days": "30"
+    }
+    
+    for key, value in resets.items():
+        setting = db.query(Settings).filter(Settings.key == key).first()
+        if setting:
+            setting.value = value
+        else:
+            db.add(Settings(key=key, value=value))
+    
+    db.commit()
+    invalidate_settings_cache()
+    
+    # 3. Clear Snapshots directory
+    if os.path.exists(SNAPSHOTS_DIR):
+        import shutil
+        for filename in os.listdir(SNAPSHOTS_DIR):
+            file_path = os.path.join(SNAPSHOTS_DIR, filename)
+            try:
+                if os.path.isfile(file_path) or os.path.islink(file_path):
+                    os.unlink(file_path)
+                elif os.path.isdir(file_path):
+                    shutil.rmtree(file_path)
+            except Exception as e:
+                logger.error(f"Failed to delete {file_path}: {e}")
+
 @app.post("/api/reset")
 async def reset_system(request: ResetRequest, db: Session = Depends(get_db), admin=Depends(get_current_admin)):
     """Refined Factory Reset: Wipes dynamic data, preserves MQTT/API keys, sets defaults."""
@@ -3062,79 +3421,90 @@ async def reset_system(request: ResetRequest, db: Session = Depends(get_db), adm
         raise HTTPException(status_code=400, detail="Bekräftelse krävs.")
     
     try:
-        # 1. Clear dynamic tables
-        db.query(TrafficEvent).delete()
-        db.query(TrafficEventVersion).delete()
-        db.query(Camera).delete()
-        db.query(RoadCondition).delete()
-        db.query(ClientInterest).delete()
-        db.query(PushSubscription).delete()
-        
-        # 2. Reset specific settings to required defaults 
-        # (while preserving api_key, mqtt_*, admin_password)
-        resets = {
-            "push_notifications_enabled": "false",
-            "sound_notifications_enabled": "false",
-            "selected_counties": "1", # Stockholms Län
-            "camera_radius_km": "8.0",
-            "retention_days": "30"
-        }
-        
-        for key, value in resets.items():
-            setting = db.query(Settings).filter(Settings.key == key).first()
-            if setting:
-                setting.value = value
-            else:
-                db.add(Settings(key=key, value=value))
-        
-        db.commit()
-        
-        # 3. Clear Snapshots directory
-        if os.path.exists(SNAPSHOTS_DIR):
-            import shutil
-            for filename in os.listdir(SNAPSHOTS_DIR):
-                file_path = os.path.join(SNAPSHOTS_DIR, filename)
-                try:
-                    if os.path.isfile(file_path) or os.path.islink(file_path):
-                        os.unlink(file_path)
-                    elif os.path.isdir(file_path):
-                        shutil.rmtree(file_path)
-                except Exception as e:
-                    logger.error(f"Failed to delete {file_path}: {e}")
-                    
+        await asyncio.to_thread(_do_reset, db)
         logger.info("System Refined Reset performed by admin.")
         return {"status": "ok", "message": "Systemet har återställts (Inställningar för API/MQTT behölls)."}
     except Exception as e:
         logger.error(f"Reset failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+# Frequently requested files from frontend/public. They are not fingerprinted by the build,
+# so they get a bounded max-age; index.html, sw.js and the manifest must always be revalidated.
+HOT_STATIC_FILES = {
+    "index.html": "no-cache",
+    "sw.js": "no-cache",
+    "manifest.json": "no-cache",
+    "logo.png": "public, max-age=86400",
+    "icon-192.png": "public, max-age=86400",
+    "icon-512.png": "public, max-age=86400",
+    "maskable-icon-512.png": "public, max-age=86400",
+    "notification-icon.png": "public, max-age=86400",
+    "vite.svg": "public, max-age=86400",
+    "favicon.ico": "public, max-age=86400",
+}
+
+def static_file_response(file_path: str, request: Request, cache_control: str = "no-cache"):
+    """FileResponse with Cache-Control that answers If-None-Match/If-Modified-Since with 304."""
+    stat_result = os.stat(file_path)
+    response = FileResponse(file_path, stat_result=stat_result, headers={"Cache-Control": cache_control})
+    etag = response.headers["etag"]
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        not_modified = etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+    else:
+        not_modified = request.headers.get("if-modified-since") == response.headers["last-modified"]
+    if not_modified:
+        return Response(status_code=304, headers={
+            "ETag": etag,
+            "Last-Modified": response.headers["last-modified"],
+            "Cache-Control": cache_control
+        })
+    return response
+
 # Static files and SPA fallback
 if os.path.exists("static"):
     app.mount("/assets", StaticFiles(directory="static/assets"), name="assets")
 
+    def make_hot_file_route(filename: str, cache_control: str):
+        file_path = os.path.join("static", filename)
+        async def serve_hot_file(request: Request):
+            if not os.path.isfile(file_path):
+                return static_file_response("static/index.html", request)
+            return static_file_response(file_path, request, cache_control)
+        return serve_hot_file
+
+    for _filename, _cache_control in HOT_STATIC_FILES.items():
+        app.add_api_route(f"/{_filename}", make_hot_file_route(_filename, _cache_control), methods=["GET"], include_in_schema=False)
+
     @app.get("/{full_path:path}")
-    async def serve_spa(full_path: str):
+    async def serve_spa(full_path: str, request: Request):
         if full_path.startswith("api"):
             raise HTTPException(status_code=404)
         
         file_path = os.path.join("static", full_path)
         if os.path.isfile(file_path):
-            return FileResponse(file_path)
-        return FileResponse("static/index.html")
+            return static_file_response(file_path, request, "public, max-age=3600")
+        return static_file_response("static/index.html", request)
 
-@app.on_event("startup")
 async def startup_event():
     # 1. Initialize Database
     init_db()
+
+    global mqtt_pump_task
+    mqtt_pump_task = asyncio.create_task(mqtt_pump())
     
     db = SessionLocal()
     try:
-        # 2. Seed default settings
+        # 2. Seed default settings (ON CONFLICT DO NOTHING: several workers may start at once)
+        existing_keys = {row.key for row in db.query(Settings.key).filter(Settings.key.in_(list(DEFAULTS))).all()}
         for key, val in DEFAULTS.items():
-            existing = db.query(Settings).filter(Settings.key == key).first()
-            if not existing:
+            if key not in existing_keys:
                 logger.info(f"Seeding default setting '{key}' = '{val}'")
-                db.add(Settings(key=key, value=val))
+        db.execute(
+            sqlite_insert(Settings)
+            .values([{"key": key, "value": val} for key, val in DEFAULTS.items()])
+            .on_conflict_do_nothing(index_elements=["key"])
+        )
         db.commit()
 
         # 3. Handle VAPID legacy cleanup
@@ -3144,31 +3514,27 @@ async def startup_event():
             db.query(Settings).filter(Settings.key.in_(["vapid_private_key", "vapid_public_key"])).delete(synchronize_session=False)
             db.commit()
 
-        # 4. Configure MQTT
-        mqtt_enabled = db.query(Settings).filter(Settings.key == "mqtt_enabled").first()
-        mqtt_host = db.query(Settings).filter(Settings.key == "mqtt_host").first()
-        mqtt_port = db.query(Settings).filter(Settings.key == "mqtt_port").first()
-        mqtt_user = db.query(Settings).filter(Settings.key == "mqtt_username").first()
-        mqtt_pass = db.query(Settings).filter(Settings.key == "mqtt_password").first()
-        mqtt_topic = db.query(Settings).filter(Settings.key == "mqtt_topic").first()
+        # 4. Configure MQTT (startup settings read with one query)
+        startup_keys = ["mqtt_enabled", "mqtt_host", "mqtt_port", "mqtt_username", "mqtt_password", "mqtt_topic", "api_key"]
+        startup_settings = dict(db.query(Settings.key, Settings.value).filter(Settings.key.in_(startup_keys)).all())
 
         mqtt_config = {
-            "enabled": mqtt_enabled.value.lower() == "true" if mqtt_enabled else False
+            "enabled": startup_settings["mqtt_enabled"].lower() == "true" if "mqtt_enabled" in startup_settings else False
         }
-        if mqtt_host: mqtt_config["host"] = mqtt_host.value
-        if mqtt_port: mqtt_config["port"] = int(mqtt_port.value)
-        if mqtt_user: mqtt_config["username"] = mqtt_user.value
-        if mqtt_pass: mqtt_config["password"] = mqtt_pass.value
-        if mqtt_topic: mqtt_config["topic"] = mqtt_topic.value
+        if "mqtt_host" in startup_settings: mqtt_config["host"] = startup_settings["mqtt_host"]
+        if "mqtt_port" in startup_settings: mqtt_config["port"] = int(startup_settings["mqtt_port"])
+        if "mqtt_username" in startup_settings: mqtt_config["username"] = startup_settings["mqtt_username"]
+        if "mqtt_password" in startup_settings: mqtt_config["password"] = startup_settings["mqtt_password"]
+        if "mqtt_topic" in startup_settings: mqtt_config["topic"] = startup_settings["mqtt_topic"]
         mqtt_client.update_config(mqtt_config)
 
         # 5. Start Workers (Family Model)
-        api_key_set = db.query(Settings).filter(Settings.key == "api_key").first()
-        if api_key_set and api_key_set.value:
+        api_key = startup_settings.get("api_key")
+        if api_key:
              global dynamic_worker_task
              if not dynamic_worker_task or dynamic_worker_task.done():
                 logger.info("Starting Dynamic Worker Manager (Family Model)...")
-                dynamic_worker_task = asyncio.create_task(dynamic_worker_manager(api_key_set.value))
+                dynamic_worker_task = asyncio.create_task(dynamic_worker_manager(api_key))
         else:
              logger.warning("No API key configured. Workers waiting for configuration.")
 
@@ -3177,4 +3543,13 @@ async def startup_event():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # SSE fanout and caches live in-process, so always a single worker
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        loop="uvloop",
+        http="httptools",
+        workers=1,
+        log_level="info"
+    )
@@ -1,12 +1,38 @@
 import paho.mqtt.client as mqtt
-import json
+import orjson
 import logging
+import asyncio
+import random
+import threading
 
 logger = logging.getLogger(__name__)
 
+# Outgoing backlog limit; traffic events are worthless once stale, so a slow broker drops instead of buffering
+MAX_QUEUED_MESSAGES = 500
+MAX_INFLIGHT_MESSAGES = 20
+# Reconnect backoff in seconds (doubled per failed attempt, plus up to 1 s jitter)
+RECONNECT_MIN_DELAY = 2
+RECONNECT_MAX_DELAY = 128
+
+def compact_event(event_data):
+    """Drops None fields from an event payload; consumers treat a missing key as null."""
+    return {k: v for k, v in event_data.items() if v is not None}
+
 class MQTTClient:
     def __init__(self):
         self.client = mqtt.Client()
+        # Publishes are pipelined instead of waiting for each one to be acknowledged
+        self.client.max_inflight_messages_set(MAX_INFLIGHT_MESSAGES)
+        self.client.max_queued_messages_set(MAX_QUEUED_MESSAGES)
+        # Only used by paho's network thread, when connecting without a running event loop
+        self.client.reconnect_delay_set(min_delay=RECONNECT_MIN_DELAY, max_delay=RECONNECT_MAX_DELAY)
+        # Socket I/O runs on the asyncio loop instead of a loop_start() thread
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = self._on_socket_unregister_write
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_publish = self._on_publish
         self.config = {
             "enabled": False,
             "host": "localhost",
@@ -16,12 +42,30 @@ class MQTTClient:
             "topic": "trafikinfo/traffic"
         }
         self.connected = False
+        self._backoff = RECONNECT_MIN_DELAY
+        self._retry_handle = None
+        self._connect_task = None
+        self._connect_lock = threading.Lock()
+        self.loop = None
+        self._loop_thread = None
+        self._misc_task = None
+        # Messages handed to paho but not yet written out (QoS 0) or acknowledged
+        self._pending = 0
+        self._pending_lock = threading.Lock()
 
     def update_config(self, new_config):
         self.config.update(new_config)
         self.reconnect()
 
     def reconnect(self):
+        # New settings: drop any pending retry and start over with the shortest delay
+        if self._retry_handle:
+            self._retry_handle.cancel()
+            self._retry_handle = None
+        if self._connect_task:
+            self._connect_task.cancel()
+            self._connect_task = None
+        self._backoff = RECONNECT_MIN_DELAY
         try:
             if self.connected:
                 self.client.disconnect()
@@ -32,40 +76,189 @@ class MQTTClient:
                 logger.info("MQTT is disabled in settings, skipping connection")
                 return
 
-            if self.config["username"]:
-                self.client.username_pw_set(self.config["username"], self.config["password"])
-            
-            self.client.connect(self.config["host"], self.config["port"], 60)
-            self.client.loop_start()
-            self.connected = True
-            logger.info(f"Connected to MQTT broker at {self.config['host']}")
+            self._connect()
         except Exception as e:
             logger.error(f"Failed to connect to MQTT: {e}")
             self.connected = False
+            self._schedule_retry()
 
-    def publish_event(self, event_data):
-        if not self.connected:
-            logger.warning("MQTT not connected, skipping publish")
-            return False
+    def _connect(self):
+        if self.config["username"]:
+            self.client.username_pw_set(self.config["username"], self.config["password"])
         
         try:
-            payload = json.dumps(event_data)
-            info = self.client.publish(self.config["topic"], payload)
-            info.wait_for_publish(timeout=2.0) # Wait a bit to ensure it goes out
-            logger.debug(f"Published to {self.config['topic']}: {event_data.get('external_id')}")
-            return True
+            self.loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.loop = None
+        if self.loop is None:
+            self._blocking_connect()
+            self.client.loop_start()
+            self._on_connected()
+            return
+        self._loop_thread = threading.get_ident()
+        self._connect_task = self.loop.create_task(self._connect_off_loop())
+
+    async def _connect_off_loop(self):
+        # DNS lookup and TCP handshake block for up to the socket timeout while the broker is unreachable
+        try:
+            await asyncio.to_thread(self._blocking_connect)
         except Exception as e:
-            logger.error(f"Failed to publish to MQTT: {e}")
-            return False
+            logger.error(f"Failed to connect to MQTT: {e}")
+            self.connected = False
+            self._schedule_retry()
+            return
+        self._on_connected()
+
+    def _blocking_connect(self):
+        # A cancelled attempt may still be running in its thread, paho must not connect twice at once
+        with self._connect_lock:
+            self.client.connect(self.config["host"], self.config["port"], 60)
+
+    def _on_connected(self):
+        self.connected = True
+        # A retry left over from before a manual update_config must not reconnect an established session
+        if self._retry_handle:
+            self._retry_handle.cancel()
+            self._retry_handle = None
+        self._connect_task = None
+        self._backoff = RECONNECT_MIN_DELAY
+        logger.info(f"Connected to MQTT broker at {self.config['host']}")
+
+    def _schedule_retry(self):
+        """Retries the initial connect on the event loop with exponential backoff and jitter."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        delay = min(self._backoff, RECONNECT_MAX_DELAY) + random.uniform(0, 1)
+        self._backoff *= 2
+        logger.info(f"Retrying MQTT connection in {delay:.0f}s")
+        self._retry_handle = loop.call_later(delay, self._retry_connect)
+
+    def _retry_connect(self):
+        self._retry_handle = None
+        try:
+            self._connect()
+        except Exception as e:
+            logger.error(f"Failed to connect to MQTT: {e}")
+            self.connected = False
+            self._schedule_retry()
+
+    def _call_on_loop(self, callback, *args):
+        # paho fires the socket callbacks from the connect thread as well as from the loop
+        if threading.get_ident() == self._loop_thread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        if self.loop is None:
+            return
+        self._call_on_loop(self._watch_socket, sock)
+
+    def _watch_socket(self, sock):
+        self.loop.add_reader(sock, self.client.loop_read)
+        if self._misc_task:
+            self._misc_task.cancel()
+        self._misc_task = self.loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client, userdata, sock):
+        if self.loop is None:
+            return
+        # paho closes the socket right after this callback, so hand over the descriptor instead
+        self._call_on_loop(self._unwatch_socket, sock.fileno())
+
+    def _unwatch_socket(self, fd):
+        self.loop.remove_reader(fd)
+        self.loop.remove_writer(fd)
+        if self._misc_task:
+            self._misc_task.cancel()
+            self._misc_task = None
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        if self.loop is None:
+            return
+        self._call_on_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        if self.loop is None:
+            return
+        self._call_on_loop(self.loop.remove_writer, sock.fileno())
+
+    async def _misc_loop(self):
+        # Keepalive pings and timeouts, normally done by paho's network thread
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            await asyncio.sleep(1)
+
+    def _on_publish(self, client, userdata, mid):
+        self._release_pending()
+
+    def _release_pending(self):
+        with self._pending_lock:
+            self._pending = max(0, self._pending - 1)
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.connected = False
+        # paho drops unsent QoS 0 packets with the connection
+        with self._pending_lock:
+            self._pending = 0
+        if rc != mqtt.MQTT_ERR_SUCCESS:
+            logger.warning(f"MQTT connection lost: {mqtt.error_string(rc)}")
+            connecting = self._connect_task is not None and not self._connect_task.done()
+            if self.loop is not None and self.config.get("enabled") and not self._retry_handle and not connecting:
+                self._schedule_retry()
+
+    def publish_events(self, events):
+        """Publishes a batch of events back-to-back without waiting for delivery.
+        Returns a list with one success flag per event."""
+        if not self.connected:
+            logger.warning("MQTT not connected, skipping publish")
+            return [False] * len(events)
+
+        topic = self.config["topic"]
+        send = self._send
+        dumps = orjson.dumps
+        results = []
+        append = results.append
+        for event_data in events:
+            try:
+                payload = dumps(compact_event(event_data))
+            except TypeError as e:
+                logger.error(f"Failed to encode MQTT event {event_data.get('external_id')}: {e}")
+                append(False)
+                continue
+            append(send(topic, payload))
+        logger.debug(f"Published {sum(results)}/{len(results)} events to {topic}")
+        return results
 
     def publish(self, topic, payload):
         """Generic publish method"""
         if not self.connected:
             return False
             
+        return self._send(topic, payload)
+
+    def _send(self, topic, payload):
         try:
-            info = self.client.publish(topic, payload)
-            info.wait_for_publish(timeout=2.0)
+            # QoS 0 messages bypass max_queued_messages, so keep our own count of the outgoing backlog
+            with self._pending_lock:
+                if self._pending >= MAX_QUEUED_MESSAGES:
+                    logger.warning(f"MQTT backlog full, dropping message to {topic}")
+                    return False
+                # Counted before publishing, on_publish may fire from inside publish()
+                self._pending += 1
+            try:
+                info = self.client.publish(topic, payload)
+            except Exception:
+                self._release_pending()
+                raise
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                self._release_pending()
+                if info.rc == mqtt.MQTT_ERR_QUEUE_SIZE:
+                    logger.warning(f"MQTT queue full, dropping message to {topic}")
+                else:
+                    logger.error(f"Failed to publish to {topic}: {mqtt.error_string(info.rc)}")
+                return False
             return True
         except Exception as e:
             logger.error(f"Failed to publish to {topic}: {e}")
@@ -1,13 +1,104 @@
 import httpx
 import logging
 import asyncio
-import xml.etree.ElementTree as ET
-from sse_starlette.sse import EventSourceResponse
+from collections import deque
 import re
+import random
+import time
+from functools import lru_cache
+from dataclasses import dataclass, fields
+import orjson
+import numpy as np
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
 
+STREAM_BUFFER_SIZE = 2000
+# Seconds an SSE URL is reused across stream reconnects
+SSE_URL_TTL = 300
+# One HTTP/2 connection carries the stream and the API queries; keep a couple of spares for reconnects
+STREAM_HTTP_LIMITS = httpx.Limits(max_connections=10, max_keepalive_connections=4)
+
+# object_type -> (schema version, namespace, county filter field)
+SSE_SCHEMAS = {
+    "Situation": ("1.6", "Road.TrafficInfo", "Deviation.CountyNo"),
+    "RoadCondition": ("1.3", "Road.TrafficInfo", "CountyNo"),
+}
+SSE_QUERY_TEMPLATE = '<REQUEST><LOGIN authenticationkey="{api_key}" /><QUERY objecttype="{object_type}" schemaversion="{schema_version}" sseurl="true" namespace=\'{namespace}\'>{filter_block}</QUERY></REQUEST>'
+
+@lru_cache(maxsize=64)
+def build_sse_query(api_key: str, county_ids: tuple, object_type: str):
+    """Request XML for an SSE URL, pre-encoded for the POST body; cached, since it only changes with the selected counties."""
+    schema_version, namespace, filter_field = SSE_SCHEMAS.get(object_type, SSE_SCHEMAS["Situation"])
+
+    filter_block = ""
+    if county_ids:
+        # Filter out '0' (Alla län) just in case it's passed explicitly, we'll add it back below
+        valid_ids = set([str(cid) for cid in county_ids if str(cid) != "0"])
+        
+        # Special case for Stockholm: If 1 is requested, also request 2 (Legacy)
+        if "1" in valid_ids:
+            valid_ids.add("2")
+
+        # Always listen to National/Global events (ID 0)
+        valid_ids.add("0")
+
+        # Build <OR><EQ name="Field" value="X" />...</OR>
+        conditions = "".join([f'<EQ name="{filter_field}" value="{cid}" />' for cid in sorted(valid_ids)])
+        filter_block = f"<FILTER><OR>{conditions}</OR></FILTER>"
+
+    return SSE_QUERY_TEMPLATE.format(
+        api_key=api_key, object_type=object_type, schema_version=schema_version,
+        namespace=namespace, filter_block=filter_block
+    ).encode()
+
+# Mapping from IconId to Swedish text
+ICON_TEXT_MAP = {
+    "vehicleBreakdown": "Fordonshaveri",
+    "accident": "Trafikolycka",
+    "roadWork": "Vägarbete",
+    "congestion": "Köbildning",
+    "obstruction": "Hinder på väg",
+    "roadConditions": "Väglag",
+    "trafficMessage": "Trafikmeddelande"
+}
+
+# Road condition text when ConditionInfo is missing
+CONDITION_CODE_MAP = {
+    1: "Normalt",
+    2: "Besvärligt (risk för)",
+    3: "Mycket besvärligt",
+    4: "Is- och snövägbana"
+}
+
+# Road numbers in camera names (e.g. E4, Rv73, Lv155)
+ROAD_RE = re.compile(r'\b(E\d+|RV\d+|LV\d+|VÄG\d+|LÄN\d+)\b', re.I)
+# Road numbers in camera location/name, allowing "Väg 73"
+CAMERA_ROAD_RE = re.compile(r'\b(E\d+|RV\d+|LV\d+|VÄG\s*\d+|LÄN\s*\d+)\b', re.I)
+ROAD_PREFIX_RE = re.compile(r'^(Väg|Riksväg|Länsväg|RV|LV|Län)\s*', re.I)
+
+def parse_wgs84(wgs84):
+    """Returns (longitude, latitude) of the first point of a WGS84 POINT/LINESTRING, or (None, None)."""
+    try:
+        lon, _, lat = wgs84.partition('(')[2].lstrip('(').partition(',')[0].partition(' ')
+        return float(lon), float(lat.rstrip(')'))
+    except AttributeError:
+        return None, None
+    except ValueError:
+        pass
+    # 3D points and irregular spacing
+    try:
+        coords = wgs84[wgs84.index('(') + 1:].lstrip('(').split(',', 1)[0].split()
+        return float(coords[0]), float(coords[1].rstrip(')'))
+    except (ValueError, IndexError):
+        return None, None
+
+def first_county_no(counties):
+    """CountyNo comes as a list or a single int; returns the first county or 0."""
+    if isinstance(counties, list):
+        return counties[0] if counties else 0
+    return counties if isinstance(counties, int) else 0
+
 class TrafikverketStream:
     def __init__(self, api_key: str):
         self.api_key = api_key
@@ -16,133 +107,157 @@ class TrafikverketStream:
         self.running = False
         self.connected = False
         self.last_error = None
-        self.queue = asyncio.Queue()
+        # Payloads waiting for the processor; the oldest are dropped if it falls this far behind
+        self.buffer = deque(maxlen=STREAM_BUFFER_SIZE)
+        self.data_ready = asyncio.Event()
+        # Shared by all requests of this stream, keeps connections (and TLS sessions) alive
+        self.http_client = httpx.AsyncClient(timeout=30.0, http2=True, limits=STREAM_HTTP_LIMITS)
         self.last_activity = datetime.now()
+        # Retry delay in seconds, doubled per failure and reset once data flows again
+        self._backoff = 2
+        # SSE URL reused across reconnects until it expires or the stream rejects it
+        self._sse_url = None
+        self._sse_url_expiry = 0.0
 
-        
 
     async def get_sse_url(self, county_ids: list = None, object_type: str = "Situation"):
-        # Determine schema version, namespace, and filter field
-        schema_version = "1.6"
-        namespace = "Road.TrafficInfo"
-        filter_field = "Deviation.CountyNo"
-        
-        if object_type == "RoadCondition":
-            schema_version = "1.3"
-            namespace = "Road.TrafficInfo"
-            filter_field = "CountyNo"
+        schema_version = SSE_SCHEMAS.get(object_type, SSE_SCHEMAS["Situation"])[0]
+        query = build_sse_query(self.api_key, tuple(county_ids or ()), object_type)
 
-        filter_block = ""
-        if county_ids:
-            # Filter out '0' (Alla län) just in case it's passed explicitly, we'll add it back below
-            valid_ids = set([str(cid) for cid in county_ids if str(cid) != "0"])
-            
-            # Special case for Stockholm: If 1 is requested, also request 2 (Legacy)
-            if "1" in valid_ids:
-                valid_ids.add("2")
-
-            # Always listen to National/Global events (ID 0)
-            valid_ids.add("0")
-
-            if valid_ids:
-                # Build <OR><EQ name="Field" value="X" />...</OR>
-                conditions = "".join([f'<EQ name="{filter_field}" value="{cid}" />' for cid in sorted(valid_ids)])
-                filter_block = f"<FILTER><OR>{conditions}</OR></FILTER>"
-        
-        namespace_attr = f" namespace='{namespace}'" if namespace else ""
-
-        query = f'<REQUEST><LOGIN authenticationkey="{self.api_key}" /><QUERY objecttype="{object_type}" schemaversion="{schema_version}" sseurl="true"{namespace_attr}>{filter_block}</QUERY></REQUEST>'
-        
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            try:
-                headers = {
-                    "Content-Type": "text/xml",
-                    "Accept": "application/json"
-                }
-                response = await client.post(self.base_url, content=query, headers=headers)
-                response.raise_for_status()
-                data = response.json()
-                # The response contains a link to the SSE stream
-                sse_url = data['RESPONSE']['RESULT'][0]['INFO']['SSEURL']
-                self.connected = True
-                self.last_error = None
-                return sse_url
-            except Exception as e:
-                self.connected = False
-                self.last_error = str(e)
-                error_detail = ""
-                if hasattr(e, 'response'):
-                    error_detail = f" - {e.response.text}"
-                logger.error(f"Failed to get SSE URL for {object_type} v{schema_version}: {e}{error_detail}")
-                return None
+        try:
+            headers = {
+                "Content-Type": "text/xml",
+                "Accept": "application/json"
+            }
+            response = await self.http_client.post(self.base_url, content=query, headers=headers, timeout=15.0)
+            response.raise_for_status()
+            data = orjson.loads(response.content)
+            # The response contains a link to the SSE stream
+            sse_url = data['RESPONSE']['RESULT'][0]['INFO']['SSEURL']
+            self.connected = True
+            self.last_error = None
+            return sse_url
+        except Exception as e:
+            self.connected = False
+            self.last_error = str(e)
+            error_detail = ""
+            if hasattr(e, 'response'):
+                error_detail = f" - {e.response.text}"
+            logger.error(f"Failed to get SSE URL for {object_type} v{schema_version}: {e}{error_detail}")
+            return None
 
     async def test_connection(self):
         """Minimal query to check if API is reachable and key is valid."""
         query = f'<REQUEST><LOGIN authenticationkey="{self.api_key}" /><QUERY objecttype="Icon" schemaversion="1.1" namespace="Road.Infrastructure" limit="1"><INCLUDE>Id</INCLUDE></QUERY></REQUEST>'
-        async with httpx.AsyncClient(timeout=10.0) as client:
-            try:
-                headers = {"Content-Type": "text/xml", "Accept": "application/json"}
-                response = await client.post(self.base_url, content=query, headers=headers)
-                response.raise_for_status()
-                # If we get here, the API is reachable and the key is valid
-                self.connected = True
-                self.last_error = None
-                self.last_activity = datetime.now()
-                return True
-            except Exception as e:
-                self.connected = False
-                self.last_error = str(e)
-                logger.error(f"Connection test failed: {e}")
-                return False
+        try:
+            headers = {"Content-Type": "text/xml", "Accept": "application/json"}
+            response = await self.http_client.post(self.base_url, content=query, headers=headers, timeout=10.0)
+            response.raise_for_status()
+            # If we get here, the API is reachable and the key is valid
+            self.connected = True
+            self.last_error = None
+            self.last_activity = datetime.now()
+            return True
+        except Exception as e:
+            self.connected = False
+            self.last_error = str(e)
+            logger.error(f"Connection test failed: {e}")
+            return False
 
     async def start_streaming(self, county_ids: list = None, object_type: str = "Situation"):
         self.running = True
         while self.running:
-            sse_url = await self.get_sse_url(county_ids=county_ids, object_type=object_type)
-            if not sse_url:
-                await asyncio.sleep(10)
-                continue
+            if not self._sse_url or time.monotonic() >= self._sse_url_expiry:
+                self._sse_url = await self.get_sse_url(county_ids=county_ids, object_type=object_type)
+                if not self._sse_url:
+                    await self._sleep_backoff()
+                    continue
+                self._sse_url_expiry = time.monotonic() + SSE_URL_TTL
 
             try:
-                async with httpx.AsyncClient(timeout=None) as client:
-                    async with client.stream("GET", sse_url) as response:
-                        self.connected = True
-                        async for line in response.aiter_lines():
-                            if not self.running:
-                                break
-                            if line.startswith("data:"):
-                                data = line[5:].strip()
+                async with self.http_client.stream("GET", self._sse_url, timeout=None) as response:
+                    if 400 <= response.status_code < 500:
+                        # Expired or invalid stream URL, fetch a new one on the next attempt
+                        self._sse_url = None
+                    response.raise_for_status()
+                    self.connected = True
+                    # Split the raw byte stream into lines ourselves; payloads stay bytes for orjson
+                    partial = bytearray()
+                    async for chunk in response.aiter_bytes():
+                        if not self.running:
+                            break
+                        last_nl = chunk.rfind(b"\n")
+                        if last_nl == -1:
+                            partial += chunk
+                            continue
+                        partial += chunk[:last_nl]
+                        lines = partial.split(b"\n")
+                        partial = bytearray(chunk[last_nl + 1:])
+                        for line in lines:
+                            if line.startswith(b"data:"):
+                                data = bytes(line[5:].strip())
                                 if data:
                                     self.last_activity = datetime.now()
-                                    await self.queue.put(data)
+                                    self._backoff = 2
+                                    if len(self.buffer) == self.buffer.maxlen:
+                                        logger.warning("Stream buffer full, dropping oldest payload")
+                                    self.buffer.append(data)
+                                    self.data_ready.set()
+                if self.running:
+                    # The server closed the stream; reconnect on the cached URL after a short pause
+                    logger.info("Stream closed by server, reconnecting")
+                    await self._sleep_backoff()
             except Exception as e:
                 self.connected = False
                 self.last_error = str(e)
                 logger.error(f"Stream error: {e}")
-                await asyncio.sleep(5)
+                await self._sleep_backoff()
+
+    async def _sleep_backoff(self):
+        # Exponential backoff with jitter, capped at ~2 minutes
+        await asyncio.sleep(min(self._backoff, 128) + random.uniform(0, 1))
+        self._backoff *= 2
 
     def stop_streaming(self):
         self.running = False
         self.connected = False
 
+    async def aclose(self):
+        await self.http_client.aclose()
+
     async def get_events(self):
         while True:
-            data = await self.queue.get()
-            yield data
+            if not self.buffer:
+                self.data_ready.clear()
+                await self.data_ready.wait()
+            while self.buffer:
+                yield self.buffer.popleft()
+
+    async def get_event_batches(self, max_batch: int = 64):
+        """Like get_events, but yields everything buffered (up to max_batch payloads) as one list."""
+        buffer = self.buffer
+        while True:
+            if not buffer:
+                self.data_ready.clear()
+                await self.data_ready.wait()
+            batch = []
+            while buffer and len(batch) < max_batch:
+                batch.append(buffer.popleft())
+            if batch:
+                yield batch
 
     async def fetch_icons(self):
         """Fetches all available icons from Road.Infrastructure"""
         query = f'<REQUEST><LOGIN authenticationkey="{self.api_key}" /><QUERY objecttype="Icon" schemaversion="1.1" namespace="Road.Infrastructure"><FILTER><EQ name="Deleted" value="false" /></FILTER></QUERY></REQUEST>'
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            try:
-                headers = {"Content-Type": "text/xml", "Accept": "application/json"}
-                response = await client.post(self.base_url, content=query, headers=headers)
-                response.raise_for_status()
-                data = response.json()
-                return data['RESPONSE']['RESULT'][0]['Icon']
-            except Exception as e:
-                logger.error(f"Failed to fetch icons: {e}")
-                return []
+        try:
+            headers = {"Content-Type": "text/xml", "Accept": "application/json"}
+            response = await self.http_client.post(self.base_url, content=query, headers=headers, timeout=15.0)
+            response.raise_for_status()
+            data = orjson.loads(response.content)
+            return data['RESPONSE']['RESULT'][0]['Icon']
+        except Exception as e:
+            logger.error(f"Failed to fetch icons: {e}")
+            return []
 
     async def fetch_weather_stations(self, county_ids: list = None):
         """Fetches all weather measurepoints from road.weatherinfo"""
@@ -150,33 +265,31 @@ class TrafikverketStream:
         filter_block = '<EQ name="Deleted" value="false" />'
 
         query = f'<REQUEST><LOGIN authenticationkey="{self.api_key}" /><QUERY objecttype="WeatherMeasurepoint" schemaversion="2.1" namespace="road.weatherinfo"><FILTER>{filter_block}</FILTER><INCLUDE>Id</INCLUDE><INCLUDE>Name</INCLUDE><INCLUDE>Geometry</INCLUDE></QUERY></REQUEST>'
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            try:
-                headers = {"Content-Type": "text/xml", "Accept": "application/json"}
-                response = await client.post(self.base_url, content=query, headers=headers)
-                if response.status_code >= 400:
-                    logger.error(f"Weather API Error {response.status_code}: {response.text}")
-                response.raise_for_status()
-                data = response.json()
-                return data['RESPONSE']['RESULT'][0]['WeatherMeasurepoint']
-            except Exception as e:
-                logger.error(f"Failed to fetch weather stations: {e}")
-                return []
+        try:
+            headers = {"Content-Type": "text/xml", "Accept": "application/json"}
+            response = await self.http_client.post(self.base_url, content=query, headers=headers, timeout=15.0)
+            if response.status_code >= 400:
+                logger.error(f"Weather API Error {response.status_code}: {response.text}")
+            response.raise_for_status()
+            data = orjson.loads(response.content)
+            return data['RESPONSE']['RESULT'][0]['WeatherMeasurepoint']
+        except Exception as e:
+            logger.error(f"Failed to fetch weather stations: {e}")
+            return []
 
     async def fetch_weather_measurepoint(self, sid: str):
         """Fetches a specific weather measurepoint by ID (v2.1)"""
         query = f'<REQUEST><LOGIN authenticationkey="{self.api_key}" /><QUERY objecttype="WeatherMeasurepoint" schemaversion="2.1" namespace="road.weatherinfo"><FILTER><EQ name="Id" value="{sid}" /></FILTER><INCLUDE>Id</INCLUDE><INCLUDE>Name</INCLUDE><INCLUDE>Geometry</INCLUDE><INCLUDE>Observation</INCLUDE></QUERY></REQUEST>'
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            try:
-                headers = {"Content-Type": "text/xml", "Accept": "application/json"}
-                response = await client.post(self.base_url, content=query, headers=headers)
-                response.raise_for_status()
-                data = response.json()
-                points = data['RESPONSE']['RESULT'][0].get('WeatherMeasurepoint', [])
-                return points[0] if points else None
-            except Exception as e:
-                logger.error(f"Failed to fetch single weather point {sid}: {e}")
-                return None
+        try:
+            headers = {"Content-Type": "text/xml", "Accept": "application/json"}
+            response = await self.http_client.post(self.base_url, content=query, headers=headers, timeout=15.0)
+            response.raise_for_status()
+            data = orjson.loads(response.content)
+            points = data['RESPONSE']['RESULT'][0].get('WeatherMeasurepoint', [])
+            return points[0] if points else None
+        except Exception as e:
+            logger.error(f"Failed to fetch single weather point {sid}: {e}")
+            return None
 
     async def fetch_weather_observations(self, station_ids: list = None):
         """Fetches latest observations for given stations or all from Road.WeatherInfo"""
@@ -186,41 +299,58 @@ class TrafikverketStream:
             filter_block = f"<FILTER><OR>{conditions}</OR></FILTER>"
 
         query = f'<REQUEST><LOGIN authenticationkey="{self.api_key}" /><QUERY objecttype="WeatherObservation" schemaversion="1.0" namespace="Road.WeatherInfo">{filter_block}</QUERY></REQUEST>'
-        async with httpx.AsyncClient(timeout=15.0) as client:
-            try:
-                headers = {"Content-Type": "text/xml", "Accept": "application/json"}
-                response = await client.post(self.base_url, content=query, headers=headers)
-                response.raise_for_status()
-                data = response.json()
-                return data['RESPONSE']['RESULT'][0]['WeatherObservation']
-            except Exception as e:
-                logger.error(f"Failed to fetch weather observations: {e}")
-                return []
+        try:
+            headers = {"Content-Type": "text/xml", "Accept": "application/json"}
+            response = await self.http_client.post(self.base_url, content=query, headers=headers, timeout=15.0)
+            response.raise_for_status()
+            data = orjson.loads(response.content)
+            return data['RESPONSE']['RESULT'][0]['WeatherObservation']
+        except Exception as e:
+            logger.error(f"Failed to fetch weather observations: {e}")
+            return []
 
 
+@dataclass(slots=True)
+class SituationEvent:
+    """One Trafikverket Situation with its deviations merged, as returned by parse_situation."""
+    external_id: str
+    title: str
+    description: str | None
+    location: str | None
+    icon_id: str | None
+    event_type: str
+    timestamp: str | None
+    message_type: str | None
+    severity_code: int | None
+    severity_text: str | None
+    road_number: str | None
+    start_time: str | None
+    end_time: str | None
+    temporary_limit: str | None
+    traffic_restriction_type: str | None
+    latitude: float | None
+    longitude: float | None
+    county_no: int
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in SITUATION_EVENT_FIELDS}
+
+SITUATION_EVENT_FIELDS = tuple(f.name for f in fields(SituationEvent))
+
 def parse_situation(json_data):
     # Simplified parser for Trafikverket Situation object
+    parsed_events = []
+    append_event = parsed_events.append
     try:
         # Note: data coming from SSE is often a list or a single object wrapped in RESPONSE/RESULT
         # This part depends on the exact JSON structure returned by the SSE
-        import json
-        payload = json.loads(json_data)
+        payload = orjson.loads(json_data)
         
         # Structure is usually: {"RESPONSE": {"RESULT": [{"Situation": [...]}]}}
-        situations = payload.get('RESPONSE', {}).get('RESULT', [{}])[0].get('Situation', [])
-        
-        parsed_events = []
-        
-        # Mapping from IconId to Swedish text
-        icon_text_map = {
-            "vehicleBreakdown": "Fordonshaveri",
-            "accident": "Trafikolycka",
-            "roadWork": "Vägarbete",
-            "congestion": "Köbildning",
-            "obstruction": "Hinder på väg",
-            "roadConditions": "Väglag",
-            "trafficMessage": "Trafikmeddelande"
-        }
+        try:
+            situations = payload['RESPONSE']['RESULT'][0]['Situation']
+        except (KeyError, IndexError, TypeError):
+            return parsed_events
 
         for sit in situations:
             sit_id = sit.get('Id')
@@ -228,162 +358,154 @@ def parse_situation(json_data):
             if not deviations:
                 continue
 
-            # Merge deviations for this situation
-            merged_desc = []
-            merged_restrictions = []
-            merged_message_types = []
+            # Merge deviations for this situation (dicts as insertion-ordered sets)
+            merged_desc = {}
+            merged_restrictions = {}
+            merged_message_types = {}
             
             # Start with primary data from the first deviation
             first_devi = deviations[0]
-            icon_id = first_devi.get('IconId')
-            start_time = first_devi.get('StartTime')
-            end_time = first_devi.get('EndTime')
-            severity_code = first_devi.get('SeverityCode')
-            severity_text = first_devi.get('SeverityText')
-            road_number = first_devi.get('RoadNumber')
-            location = first_devi.get('LocationDescriptor')
+            first_get = first_devi.get
+            icon_id = first_get('IconId')
+            start_time = first_get('StartTime')
+            end_time = first_get('EndTime')
+            severity_code = first_get('SeverityCode')
+            severity_text = first_get('SeverityText')
+            road_number = first_get('RoadNumber')
+            location = first_get('LocationDescriptor')
             
             # Geometry from first deviation that has it
             latitude = None
             longitude = None
+            for devi in deviations:
+                geo = devi.get('Geometry')
+                if geo:
+                    wgs84 = geo.get('Point', {}).get('WGS84') or geo.get('Line', {}).get('WGS84')
+                    if wgs84:
+                        longitude, latitude = parse_wgs84(wgs84)
+                        if latitude is not None:
+                            break
             
             for devi in deviations:
+                devi_get = devi.get
                 # Descriptions
-                desc = devi.get('Description')
-                if desc and desc not in merged_desc:
-                    merged_desc.append(desc)
+                desc = devi_get('Description')
+                if desc:
+                    merged_desc[desc] = None
                 
                 # Restriction Types
-                restr = devi.get('TrafficRestrictionType')
-                if restr and restr not in merged_restrictions:
-                    merged_restrictions.append(restr)
+                restr = devi_get('TrafficRestrictionType')
+                if restr:
+                    merged_restrictions[restr] = None
                 
                 # Message Types
-                mtype = devi.get('MessageCode') or devi.get('MessageType')
-                if mtype and mtype not in merged_message_types:
-                    merged_message_types.append(mtype)
+                mtype = devi_get('MessageCode') or devi_get('MessageType')
+                if mtype:
+                    merged_message_types[mtype] = None
 
-                # Geometry
-                if latitude is None:
-                    geo = devi.get('Geometry', {})
-                    wgs84 = geo.get('Point', {}).get('WGS84') or geo.get('Line', {}).get('WGS84')
-                    if wgs84:
-                        match = re.search(r"\(([\d\.]+)\s+([\d\.]+)", wgs84)
-                        if match:
-                            longitude = float(match.group(1))
-                            latitude = float(match.group(2))
-                
                 # Time window (earliest start, latest end)
-                d_start = devi.get('StartTime')
-                d_end = devi.get('EndTime')
+                d_start = devi_get('StartTime')
+                d_end = devi_get('EndTime')
                 if d_start and (not start_time or d_start < start_time):
                     start_time = d_start
                 if d_end and (not end_time or d_end > end_time):
                     end_time = d_end
 
             # Determine title: Header -> Message -> Icon Mapping -> Merged Message Types -> Default
-            title = first_devi.get('Header') or first_devi.get('Message')
+            title = first_get('Header') or first_get('Message')
             if not title and icon_id:
-                title = icon_text_map.get(icon_id)
+                title = ICON_TEXT_MAP.get(icon_id)
             if not title:
                 title = " / ".join(merged_message_types) if merged_message_types else "Trafikhändelse"
 
             # Normalize Stockholm: map 2 to 1
-            raw_county = first_devi.get('CountyNo', [0])[0] if isinstance(first_devi.get('CountyNo'), list) else first_devi.get('CountyNo', 0)
+            raw_county = first_county_no(first_get('CountyNo'))
             final_county = 1 if str(raw_county) == "2" else raw_county
 
-            event = {
-                "external_id": sit_id, # Group by Situation ID
-                "title": title,
-                "description": " | ".join(merged_desc) if merged_desc else None,
-                "location": location,
-                "icon_id": icon_id,
-                "event_type": "Situation",
-                "timestamp": first_devi.get('CreationTime'),
-                "message_type": ", ".join(merged_message_types) if merged_message_types else None,
-                "severity_code": severity_code,
-                "severity_text": severity_text,
-                "road_number": road_number,
-                "start_time": start_time,
-                "end_time": end_time,
-                "temporary_limit": first_devi.get('TemporaryLimit'),
-                "traffic_restriction_type": ", ".join(merged_restrictions) if merged_restrictions else None,
-                "latitude": latitude,
-                "longitude": longitude,
-                "county_no": final_county
-            }
-            parsed_events.append(event)
-        return parsed_events
-    except Exception as e:
+            append_event(SituationEvent(
+                external_id=sit_id, # Group by Situation ID
+                title=title,
+                description=" | ".join(merged_desc) if merged_desc else None,
+                location=location,
+                icon_id=icon_id,
+                event_type="Situation",
+                timestamp=first_get('CreationTime'),
+                message_type=", ".join(merged_message_types) if merged_message_types else None,
+                severity_code=severity_code,
+                severity_text=severity_text,
+                road_number=road_number,
+                start_time=start_time,
+                end_time=end_time,
+                temporary_limit=first_get('TemporaryLimit'),
+                traffic_restriction_type=", ".join(merged_restrictions) if merged_restrictions else None,
+                latitude=latitude,
+                longitude=longitude,
+                county_no=final_county
+            ))
         return parsed_events
     except Exception as e:
+        # Keep whatever was parsed before the bad situation
         logger.error(f"Error parsing situation: {e}")
-        return []
+        return parsed_events
+
+def parse_situations_batch(payloads):
+    """Parses a list of SSE payloads in one call; returns one event list per payload, in order."""
+    return [parse_situation(payload) for payload in payloads]
 
 def parse_road_condition(json_data):
     try:
-        import json
-        payload = json.loads(json_data)
+        payload = orjson.loads(json_data)
         
         # Structure: RESPONSE -> RESULT -> RoadCondition
-        results = payload.get('RESPONSE', {}).get('RESULT', [{}])[0].get('RoadCondition', [])
+        try:
+            results = payload['RESPONSE']['RESULT'][0]['RoadCondition']
+        except (KeyError, IndexError, TypeError):
+            return []
         
         parsed_conditions = []
+        append_condition = parsed_conditions.append
         
         for rc in results:
+            rc_get = rc.get
             # Basic fields
-            rc_id = rc.get('Id')
-            condition_code = rc.get('ConditionCode')
-            condition_info = rc.get('ConditionInfo', [])
+            rc_id = rc_get('Id')
+            condition_code = rc_get('ConditionCode')
+            condition_info = rc_get('ConditionInfo', [])
             condition_text = condition_info[0] if condition_info else None
             
             # Map ConditionCode to text if missing
             if not condition_text and condition_code:
-                code_map = {
-                    1: "Normalt",
-                    2: "Besvärligt (risk för)",
-                    3: "Mycket besvärligt",
-                    4: "Is- och snövägbana"
-                }
-                condition_text = code_map.get(condition_code, "Okänt")
+                condition_text = CONDITION_CODE_MAP.get(condition_code, "Okänt")
 
             # Measures (Åtgärd) & Warnings & Cause & Icon & LocationText
             # Check nested TrafficInfo as well
-            traffic_info = rc.get('TrafficInfo', {})
+            traffic_info = rc_get('TrafficInfo', {})
             # Handle potential list wrapper for TrafficInfo
             if isinstance(traffic_info, list) and traffic_info:
                 traffic_info = traffic_info[0]
             elif not isinstance(traffic_info, dict):
                 traffic_info = {}
+            ti_get = traffic_info.get
 
-            measures = rc.get('Measure') or traffic_info.get('Measure', [])
-            warnings = rc.get('Warning') or traffic_info.get('Warning', [])
-            causes = rc.get('Cause') or traffic_info.get('Cause', [])
-            location_text = rc.get('LocationText') or traffic_info.get('LocationText')
-            icon_id = rc.get('IconId') or traffic_info.get('IconId')
+            measures = rc_get('Measure') or ti_get('Measure', [])
+            warnings = rc_get('Warning') or ti_get('Warning', [])
+            causes = rc_get('Cause') or ti_get('Cause', [])
+            location_text = rc_get('LocationText') or ti_get('LocationText')
+            icon_id = rc_get('IconId') or ti_get('IconId')
             
-            start_time = rc.get('StartTime')
-            end_time = rc.get('EndTime')
-            timestamp = rc.get('ModifiedTime') # Usage of ModifiedTime as timestamp source
+            start_time = rc_get('StartTime')
+            end_time = rc_get('EndTime')
+            timestamp = rc_get('ModifiedTime') # Usage of ModifiedTime as timestamp source
             
             # Geometry
             latitude = None
             longitude = None
-            wgs84 = rc.get('Geometry', {}).get('WGS84')
+            wgs84 = rc_get('Geometry', {}).get('WGS84')
             if wgs84:
-                match = re.search(r"\(([\d\.]+)\s+([\d\.]+)", wgs84)
-                if match:
-                    longitude = float(match.group(1))
-                    latitude = float(match.group(2))
+                longitude, latitude = parse_wgs84(wgs84)
 
             # County
-            # County
-            raw_counties = rc.get('CountyNo', [])
-            county_no = 0
-            if isinstance(raw_counties, list) and len(raw_counties) > 0:
-                county_no = raw_counties[0]
-            elif isinstance(raw_counties, int):
-                county_no = raw_counties
+            county_no = first_county_no(rc_get('CountyNo'))
 
             # Normalize Stockholm: map 2 to 1
             final_county = 1 if str(county_no) == "2" else county_no
@@ -397,7 +519,7 @@ def parse_road_condition(json_data):
                 "cause": ", ".join(causes) if causes else None,
                 "location_text": location_text,
                 "icon_id": icon_id,
-                "road_number": rc.get('RoadNumber'),
+                "road_number": rc_get('RoadNumber'),
                 "start_time": start_time,
                 "end_time": end_time,
                 "latitude": latitude,
@@ -405,7 +527,7 @@ def parse_road_condition(json_data):
                 "county_no": final_county,
                 "timestamp": timestamp
             }
-            parsed_conditions.append(condition)
+            append_condition(condition)
             
         return parsed_conditions
 
@@ -427,14 +549,53 @@ def calculate_distance(lat1, lon1, lat2, lon2):
     c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
     return R * c
 
+# Coordinate arrays and grid index of the current camera list, rebuilt when the list is replaced
+_camera_coords = {"cameras": None, "lats": None, "lons": None, "grid": None}
+CAMERA_GRID_DEG = 0.1 # ~11 km of latitude, ~5.5 km of longitude in central Sweden
+CAMERA_GRID_MAX_CELLS = 400 # Larger searches scan all cameras instead
+
+def _get_camera_coords(cameras):
+    if _camera_coords["cameras"] is not cameras or len(_camera_coords["lats"]) != len(cameras):
+        # Cameras without coordinates become NaN and never pass the distance check
+        lats = np.array([c.get('latitude') if c.get('latitude') is not None else np.nan for c in cameras], dtype=np.float64)
+        lons = np.array([c.get('longitude') if c.get('longitude') is not None else np.nan for c in cameras], dtype=np.float64)
+
+        # Grid cell -> camera indices
+        grid = {}
+        valid = np.flatnonzero(~np.isnan(lats) & ~np.isnan(lons))
+        cell_lats = np.floor(lats[valid] / CAMERA_GRID_DEG).astype(np.int64)
+        cell_lons = np.floor(lons[valid] / CAMERA_GRID_DEG).astype(np.int64)
+        for i, cell_lat, cell_lon in zip(valid.tolist(), cell_lats.tolist(), cell_lons.tolist()):
+            grid.setdefault((cell_lat, cell_lon), []).append(i)
+
+        _camera_coords["lats"] = lats
+        _camera_coords["lons"] = lons
+        _camera_coords["grid"] = {cell: np.array(ids, dtype=np.int64) for cell, ids in grid.items()}
+        _camera_coords["cameras"] = cameras
+    return _camera_coords["lats"], _camera_coords["lons"], _camera_coords["grid"]
+
+def _cameras_in_box(cameras, lat, lon, dlat_deg, dlon_deg):
+    """Indices of the cameras inside the lat/lon box, in camera list order."""
+    cam_lats, cam_lons, grid = _get_camera_coords(cameras)
+
+    lat_cells = range(math.floor((lat - dlat_deg) / CAMERA_GRID_DEG), math.floor((lat + dlat_deg) / CAMERA_GRID_DEG) + 1)
+    lon_cells = range(math.floor((lon - dlon_deg) / CAMERA_GRID_DEG), math.floor((lon + dlon_deg) / CAMERA_GRID_DEG) + 1)
+    if len(lat_cells) * len(lon_cells) <= CAMERA_GRID_MAX_CELLS:
+        parts = [grid[(a, b)] for a in lat_cells for b in lon_cells if (a, b) in grid]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        idx = np.sort(np.concatenate(parts))
+    else:
+        idx = np.arange(len(cameras))
+
+    # Cells reach past the box edges
+    return idx[(np.abs(cam_lats[idx] - lat) <= dlat_deg) & (np.abs(cam_lons[idx] - lon) <= dlon_deg)]
+
 def find_nearby_cameras(lat, lon, cameras, target_road=None, max_dist_km=5.0, limit=5):
     if lat is None or lon is None or not cameras:
         return []
     
     nearby = []
-    
-    # Roadmap pattern to identify roads in names (e.g. E4, Rv73, Lv155)
-    road_pattern = re.compile(r'\b(E\d+|RV\d+|LV\d+|VÄG\d+|LÄN\d+)\b', re.I)
 
     # Clean target road for matching (extract only alphanumeric, e.g. "E4" or "73")
     def clean_target(s):
@@ -443,14 +604,28 @@ def find_nearby_cameras(lat, lon, cameras, target_road=None, max_dist_km=5.0, li
 
     norm_target = clean_target(target_road)
 
-    for cam in cameras:
-        # 1. Check distance and URL validity
-        cam_url = cam.get('url')
-        if not cam_url:
-            continue
-            
-        dist = calculate_distance(lat, lon, cam.get('latitude'), cam.get('longitude'))
-        if dist > max_dist_km:
+    # 1. Bounding box (with 10% margin) from the grid index, then Haversine on those cameras only
+    dlat_deg = max_dist_km / 111.0 * 1.1
+    dlon_deg = max_dist_km / (111.0 * max(math.cos(math.radians(lat)), 0.01)) * 1.1
+    idx = _cameras_in_box(cameras, lat, lon, dlat_deg, dlon_deg)
+    if not len(idx):
+        return []
+
+    cam_lats, cam_lons, _ = _get_camera_coords(cameras)
+    lats = cam_lats[idx]
+    dlat = np.radians(lats - lat)
+    dlon = np.radians(cam_lons[idx] - lon)
+    a = np.sin(dlat / 2) ** 2 + math.cos(math.radians(lat)) * np.cos(np.radians(lats)) * np.sin(dlon / 2) ** 2
+    dists = 2 * 6371 * np.arcsin(np.sqrt(a))
+
+    # Candidates within range, closest first
+    order = np.argsort(dists, kind="stable")
+    order = order[dists[order] <= max_dist_km]
+
+    for j in order:
+        i = idx[j]
+        cam = cameras[i]
+        if not cam.get('url'):
             continue
 
         # 2. Heuristic for road matching/prevention
@@ -459,7 +634,7 @@ def find_nearby_cameras(lat, lon, cameras, target_road=None, max_dist_km=5.0, li
         if norm_target:
             # Find all road numbers mentioned in the camera name
             clean_cam_name = cam_name.replace(" ", "")
-            roads_in_cam = road_pattern.findall(clean_cam_name)
+            roads_in_cam = ROAD_RE.findall(clean_cam_name)
             
             if roads_in_cam:
                 # If camera mentions roads, but NOT our target road, skip it
@@ -469,85 +644,85 @@ def find_nearby_cameras(lat, lon, cameras, target_road=None, max_dist_km=5.0, li
         # 3. Add to candidates
         nearby.append({
             **cam,
-            "match_dist": dist
+            "match_dist": float(dists[j])
         })
+        if len(nearby) >= limit:
+            break
     
-    # Sort by distance
-    nearby.sort(key=lambda x: x["match_dist"])
-    
-    return nearby[:limit]
+    return nearby
+
+async def get_cameras(api_key: str, client: httpx.AsyncClient = None):
+    """Fetch all traffic cameras from Trafikverket API. Uses the given client, or a temporary one."""
+    if client is None:
+        async with httpx.AsyncClient(http2=True) as client:
+            return await get_cameras(api_key, client)
 
-async def get_cameras(api_key: str):
-    """Fetch all traffic cameras from Trafikverket API."""
     url = "https://api.trafikinfo.trafikverket.se/v2/data.json"
     query = f'<REQUEST><LOGIN authenticationkey="{api_key}" /><QUERY objecttype="Camera" namespace="road.infrastructure" schemaversion="1.1"><FILTER><EQ name="Deleted" value="false" /><EQ name="Active" value="true" /></FILTER><INCLUDE>Id</INCLUDE><INCLUDE>Name</INCLUDE><INCLUDE>Description</INCLUDE><INCLUDE>Type</INCLUDE><INCLUDE>PhotoUrl</INCLUDE><INCLUDE>PhotoUrlFullsize</INCLUDE><INCLUDE>PhotoUrlSketch</INCLUDE><INCLUDE>PhotoTime</INCLUDE><INCLUDE>HasFullSizePhoto</INCLUDE><INCLUDE>HasSketchImage</INCLUDE><INCLUDE>Geometry.WGS84</INCLUDE><INCLUDE>Direction</INCLUDE><INCLUDE>CountyNo</INCLUDE><INCLUDE>Location</INCLUDE></QUERY></REQUEST>'
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        try:
-            headers = {"Content-Type": "text/xml", "Accept": "application/json"}
-            response = await client.post(url, content=query, headers=headers)
-            if response.status_code != 200:
-                logger.error(f"Trafikverket API Error: {response.status_code} - {response.text}")
-            response.raise_for_status()
-            data = response.json()
-            results = data.get('RESPONSE', {}).get('RESULT', [{}])[0].get('Camera', [])
-            
-            cameras = []
-            for res in results:
-                wgs84 = res.get('Geometry', {}).get('WGS84')
-                if wgs84:
-                    match = re.search(r"\(([\d\.]+)\s+([\d\.]+)", wgs84)
-                    if match:
-                        photo_url = res.get('PhotoUrl')
-                        fullsize_url = res.get('PhotoUrlFullsize')
-
-                        # If we have a photo_url and the API says there's a fullsize version,
-                        # we ensure we have the ?type=fullsize parameter, even if PhotoUrlFullsize
-                        # was provided but didn't have it (Trafikverket often returns the same
-                        # base URL for both unless forced).
-                        if res.get('HasFullSizePhoto', False) and photo_url:
-                            # If fullsize_url is not set or doesn't contain 'type=fullsize'
-                            if not fullsize_url or "type=fullsize" not in fullsize_url:
-                                if "?" in photo_url:
-                                    fullsize_url = f"{photo_url}&type=fullsize"
-                                else:
-                                    fullsize_url = f"{photo_url}?type=fullsize"
-                        
-                        # Ensure we have all necessary fields for the internal Camera model
-                        if not photo_url:
-                            continue
-                        
-                        # CountyNo can be a list, we just take the first one or 0 if empty
-                        counties = res.get('CountyNo', [])
-                        primary_county = counties[0] if counties and isinstance(counties, list) else (counties if isinstance(counties, int) else 0)
-
-                        # Extract road number from Location or Name
-                        location = res.get('Location', '')
-                        name = res.get('Name', '')
-                        road_pattern = re.compile(r'\b(E\d+|RV\d+|LV\d+|VÄG\s*\d+|LÄN\s*\d+)\b', re.I)
-                        road_match = road_pattern.search(f"{location} {name}")
-                        road_number = road_match.group(1) if road_match else None
-                        
-                        if road_number:
-                            # Clean up: "Väg 73" -> "73", "RV73" -> "73"
-                            road_number = re.sub(r'^(Väg|Riksväg|Länsväg|RV|LV|Län)\s*', '', road_number, flags=re.I).upper()
-
-                        cameras.append({
-                            "id": res.get('Id'),
-                            "name": res.get('Name'),
-                            "description": res.get('Description'),
-                            "location": res.get('Location'),
-                            "type": res.get('Type'),
-                            "url": photo_url,
-                            "fullsize_url": fullsize_url,
-                            "photo_time": res.get('PhotoTime'),
-                            "longitude": float(match.group(1)),
-                            "latitude": float(match.group(2)),
-                            "county_no": primary_county,
-                            "road_number": road_number
-                        })
-            return cameras
-        except Exception as e:
-            logger.error(f"Failed to fetch cameras: {e}")
-            return []
+    try:
+        headers = {"Content-Type": "text/xml", "Accept": "application/json"}
+        response = await client.post(url, content=query, headers=headers, timeout=30.0)
+        if response.status_code != 200:
+            logger.error(f"Trafikverket API Error: {response.status_code} - {response.text}")
+        response.raise_for_status()
+        data = orjson.loads(response.content)
+        results = data.get('RESPONSE', {}).get('RESULT', [{}])[0].get('Camera', [])
+        
+        cameras = []
+        for res in results:
+            wgs84 = res.get('Geometry', {}).get('WGS84')
+            if wgs84:
+                cam_lon, cam_lat = parse_wgs84(wgs84)
+                if cam_lon is not None:
+                    photo_url = res.get('PhotoUrl')
+                    fullsize_url = res.get('PhotoUrlFullsize')
+
+                    # If we have a photo_url and the API says there's a fullsize version,
+                    # we ensure we have the ?type=fullsize parameter, even if PhotoUrlFullsize
+                    # was provided but didn't have it (Trafikverket often returns the same
+                    # base URL for both unless forced).
+                    if res.get('HasFullSizePhoto', False) and photo_url:
+                        # If fullsize_url is not set or doesn't contain 'type=fullsize'
+                        if not fullsize_url or "type=fullsize" not in fullsize_url:
+                            if "?" in photo_url:
+                                fullsize_url = f"{photo_url}&type=fullsize"
+                            else:
+                                fullsize_url = f"{photo_url}?type=fullsize"
+                    
+                    # Ensure we have all necessary fields for the internal Camera model
+                    if not photo_url:
+                        continue
+                    
+                    # CountyNo can be a list, we just take the first one or 0 if empty
+                    primary_county = first_county_no(res.get('CountyNo'))
+
+                    # Extract road number from Location or Name
+                    location = res.get('Location', '')
+                    name = res.get('Name', '')
+                    road_match = CAMERA_ROAD_RE.search(f"{location} {name}")
+                    road_number = road_match.group(1) if road_match else None
+                    
+                    if road_number:
+                        # Clean up: "Väg 73" -> "73", "RV73" -> "73"
+                        road_number = ROAD_PREFIX_RE.sub('', road_number).upper()
+
+                    cameras.append({
+                        "id": res.get('Id'),
+                        "name": res.get('Name'),
+                        "description": res.get('Description'),
+                        "location": res.get('Location'),
+                        "type": res.get('Type'),
+                        "url": photo_url,
+                        "fullsize_url": fullsize_url,
+                        "photo_time": res.get('PhotoTime'),
+                        "longitude": cam_lon,
+                        "latitude": cam_lat,
+                        "county_no": primary_county,
+                        "road_number": road_number
+                    })
+        return cameras
+    except Exception as e:
+        logger.error(f"Failed to fetch cameras: {e}")
+        return []
 
 